@@ -0,0 +1,198 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class CorridorTopology:
+    """
+    Plaza topology of a toll corridor, shared by TripBuilder and TravelTime. Each
+    plaza has a location in feet, a direction of travel, an order along that
+    direction, and whether it is an exit. Pair distances, free flow travel times,
+    and whether a vehicle can travel from one plaza to another are precomputed as
+    matrices indexed by plaza position, so lookups are constant time array
+    indexing. Plazas not in the topology have the position -1.
+    """
+    FEET_IN_MILE = 5280
+    DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corridor_topology.json')
+    _names: list = []
+    _positions: dict = {}  # plaza name position
+    _locations: np.ndarray = None
+    _directions: np.ndarray = None  # direction code per plaza
+    _direction_names: list = []
+    _orders: np.ndarray = None
+    _exits: np.ndarray = None
+    _free_flow_speed_mph: float = 65
+    _distance_matrix: np.ndarray = None
+    _free_flow_matrix: np.ndarray = None
+    _feasible_matrix: np.ndarray = None
+
+    def __init__(self, plazas: list, free_flow_speed_mph: float = 65):
+        """
+        :param plazas: list of dicts with the plaza name, location_feet, direction,
+        and optionally order and exit. Default order is the position in the list
+        within its direction, default exit is False
+        :param free_flow_speed_mph: free flow speed used for free flow travel times
+        """
+        if len(plazas) == 0:
+            raise ValueError('No plazas in topology')
+        self._names = [i['name'] for i in plazas]
+        self._positions = {name: c for c, name in enumerate(self._names)}
+        if len(self._positions) != len(self._names):
+            raise ValueError('Duplicate plaza names in topology')
+        self._locations = np.array([i['location_feet'] for i in plazas], dtype='float64')
+        direction_codes, direction_names = pd.factorize(pd.Series([i['direction'] for i in plazas]))
+        self._directions = direction_codes.astype(np.int8)
+        self._direction_names = list(direction_names)
+        direction_counts = {}
+        orders = []
+        for i in plazas:
+            direction_counts[i['direction']] = direction_counts.get(i['direction'], -1) + 1
+            orders.append(i.get('order', direction_counts[i['direction']]))
+        self._orders = np.array(orders, dtype=np.int32)
+        self._exits = np.array([bool(i.get('exit', False)) for i in plazas])
+        self._free_flow_speed_mph = free_flow_speed_mph
+        self.__create_matrices()
+
+    @classmethod
+    def from_json(cls, filename: str = None):
+        """
+        Load the topology from a json file with a 'plazas' list, and optionally
+        'free_flow_speed_mph'
+        :param filename: json filename. Default None, corridor_topology.json next
+        to this module
+        :return: CorridorTopology
+        """
+        if filename is None:
+            filename = cls.DEFAULT_CONFIG
+        with open(filename) as f:
+            config = json.load(f)
+        return cls(config['plazas'], config.get('free_flow_speed_mph', 65))
+
+    @classmethod
+    def from_locations(cls, locations: dict, free_flow_speed_mph: float = 65):
+        """
+        Create the topology from plaza locations. The direction is taken from the
+        NB, SB, WB, or EB prefix of the plaza name, and plazas are ordered as given.
+        :param locations: dict, plaza name and location in feet
+        :param free_flow_speed_mph: free flow speed used for free flow travel times
+        :return: CorridorTopology
+        """
+        plazas = []
+        for name, location in locations.items():
+            direction = ''
+            for i in ('NB', 'SB', 'WB', 'EB'):
+                if name.startswith(i):
+                    direction = i
+                    break
+            plazas.append({'name': name, 'location_feet': location, 'direction': direction})
+        return cls(plazas, free_flow_speed_mph)
+
+    def __create_matrices(self):
+        """
+        Precompute pair distance, free flow time, and feasibility matrices. A pair
+        is feasible when both plazas have the same direction and the second plaza
+        is not before the first.
+        """
+        self._distance_matrix = np.abs(self._locations[None, :] - self._locations[:, None])
+        seconds_per_foot = 3600 / self._free_flow_speed_mph / self.FEET_IN_MILE
+        self._free_flow_matrix = self._distance_matrix * seconds_per_foot
+        self._feasible_matrix = (self._directions[:, None] == self._directions[None, :]) & \
+            (self._orders[:, None] <= self._orders[None, :])
+
+    def get_names(self) -> list:
+        """
+        :return: list of plaza names, in position order
+        """
+        return self._names
+
+    def get_position(self, plaza: str) -> int:
+        """
+        :param plaza: plaza name
+        :return: int position, -1 if not in the topology
+        """
+        return self._positions.get(plaza, -1)
+
+    def get_positions(self, plazas) -> np.ndarray:
+        """
+        :param plazas: iterable or Pandas Series of plaza names
+        :return: int32 array of positions, -1 if not in the topology
+        """
+        positions = pd.Series(plazas).astype(object).map(self._positions)
+        return positions.fillna(-1).to_numpy(dtype=np.int32)
+
+    def get_directions(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: array of plaza positions
+        :return: int8 array of direction codes, -1 for plazas not in the topology
+        """
+        return np.where(positions >= 0, self._directions[positions], -1).astype(np.int8)
+
+    def get_direction_name(self, plaza: str) -> str:
+        """
+        :param plaza: plaza name
+        :return: str direction, None if not in the topology
+        """
+        position = self.get_position(plaza)
+        return None if position < 0 else self._direction_names[self._directions[position]]
+
+    def is_exit(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: array of plaza positions
+        :return: bool array, whether each plaza is an exit
+        """
+        return (positions >= 0) & self._exits[positions]
+
+    def get_distance(self, start: str, end: str) -> float:
+        """
+        :param start: start plaza name
+        :param end: end plaza name
+        :return: float distance in feet
+        """
+        return float(self._distance_matrix[self._positions[start], self._positions[end]])
+
+    def get_free_flow_time(self, start: str, end: str) -> float:
+        """
+        :param start: start plaza name
+        :param end: end plaza name
+        :return: float free flow travel time in seconds
+        """
+        return float(self._free_flow_matrix[self._positions[start], self._positions[end]])
+
+    def get_pair_distances(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        """
+        :param start: array of start plaza positions
+        :param end: array of end plaza positions
+        :return: float array of distances in feet, NaN for plazas not in the topology
+        """
+        known = (start >= 0) & (end >= 0)
+        return np.where(known, self._distance_matrix[start, end], np.nan)
+
+    def is_feasible(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        """
+        Whether a vehicle can travel from each start plaza to each end plaza. Pairs
+        with plazas not in the topology are feasible.
+        :param start: array of start plaza positions
+        :param end: array of end plaza positions
+        :return: bool array
+        """
+        known = (start >= 0) & (end >= 0)
+        return ~known | self._feasible_matrix[start, end]
+
+    def is_impossible_speed(self, start: np.ndarray, end: np.ndarray, seconds: np.ndarray,
+                            max_speed_mph: float = 120) -> np.ndarray:
+        """
+        Whether each pair was travelled faster than the maximum speed
+        :param start: array of start plaza positions
+        :param end: array of end plaza positions
+        :param seconds: array of elapsed seconds
+        :param max_speed_mph: maximum plausible speed
+        :return: bool array, False for plazas not in the topology
+        """
+        distance = self.get_pair_distances(start, end)
+        minimum_seconds = distance * 3600 / max_speed_mph / self.FEET_IN_MILE
+        return np.nan_to_num(minimum_seconds, nan=0) > seconds
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,54 @@
+import sys
+import os
+sys.path.append(os.getcwd() + '\\tolldata')
+
+from unittest import TestCase
+import numpy as np
+
+# PyCharm Tests, uncomment to run
+# from tolldata import CorridorTopology as ct
+
+# Pytest, uncomment to run
+import CorridorTopology as ct
+
+
+class TestCorridorTopology(TestCase):
+    topology_filename = os.path.join(os.getcwd(), 'corridor_topology.json')
+
+    def test_from_json(self):
+        topology = ct.CorridorTopology.from_json(self.topology_filename)
+        self.assertEqual(len(topology.get_names()), 21)
+        self.assertEqual(topology.get_direction_name('SB03'), 'SB')
+        self.assertEqual(topology.get_distance('NB01', 'NB03'), 15492)
+        self.assertAlmostEqual(topology.get_free_flow_time('NB01', 'NB03'), 162.5, places=1)
+
+    def test_positions_and_directions(self):
+        topology = ct.CorridorTopology.from_json(self.topology_filename)
+        positions = topology.get_positions(['NB01', 'SB01', 'XX01', 'NB10', 'SB11'])
+        self.assertEqual(positions.tolist(), [0, 10, -1, 9, 20])
+        self.assertEqual(topology.get_directions(positions).tolist(), [0, 1, -1, 0, 1])
+        self.assertEqual(topology.is_exit(positions).tolist(), [False, False, False, True, True])
+
+    def test_feasible_pairs(self):
+        topology = ct.CorridorTopology.from_json(self.topology_filename)
+        start = topology.get_positions(['NB01', 'NB05', 'NB01', 'SB01', 'XX01'])
+        end = topology.get_positions(['NB05', 'NB01', 'SB02', 'SB02', 'NB01'])
+        self.assertEqual(topology.is_feasible(start, end).tolist(), [True, False, False, True, True])
+
+    def test_impossible_speed(self):
+        topology = ct.CorridorTopology([{'name': 'A', 'location_feet': 0, 'direction': 'NB'},
+                                        {'name': 'B', 'location_feet': 5280, 'direction': 'NB'}])
+        start = np.array([0, 0, -1])
+        end = np.array([1, 1, 1])
+        result = topology.is_impossible_speed(start, end, np.array([20, 60, 1]), max_speed_mph=120)
+        self.assertEqual(result.tolist(), [True, False, False])
+
+    def test_default_config(self):
+        topology = ct.CorridorTopology.from_json()
+        self.assertEqual(topology.get_names(), ct.CorridorTopology.from_json(self.topology_filename).get_names())
+
+    def test_from_locations_direction_prefix(self):
+        topology = ct.CorridorTopology.from_locations({'SBNB01': 0, 'NB01': 100, 'XSB01': 200})
+        self.assertEqual(topology.get_direction_name('SBNB01'), 'SB')
+        self.assertEqual(topology.get_direction_name('NB01'), 'NB')
+        self.assertEqual(topology.get_direction_name('XSB01'), '')
@@ -4,7 +4,11 @@ import os
 sys.path.append(os.getcwd() + '\\tolldata')
 from unittest import TestCase
 import datetime
+import tempfile
+import time
 import pandas as pd
+import openpyxl
+import numpy as np
 
 # PyCharm Tests, uncomment to run
 # from tolldata import TollData as ra
@@ -40,6 +44,23 @@ class TestplateCombinatorics(TestCase):
         combinations = td.PlateCombinatorics(value).get_plate_combinations()
         for i in ans:
             self.assertEqual(True, i in combinations)
+        self.assertEqual(len(combinations), len(ans))
+
+    def test_max_substitutions(self):
+        combinations = td.PlateCombinatorics('B1D', max_substitutions=1).get_plate_combinations()
+        self.assertEqual(combinations, ['B1D', '81D', 'BID', 'B1O'])
+
+    def test_combinations_cached(self):
+        td.PlateCombinatorics.plate_combinations('ABC123')
+        hits = td.PlateCombinatorics._cached_combinations.cache_info().hits
+        td.PlateCombinatorics('ABC123').get_plate_combinations()
+        self.assertEqual(td.PlateCombinatorics._cached_combinations.cache_info().hits, hits + 1)
+
+    def test_expand_series(self):
+        plates = pd.Series(['B1', None, 'XY', 'B1', ''])
+        expanded = td.PlateCombinatorics.expand_series(plates, max_substitutions=1)
+        self.assertEqual(expanded['ROW'].tolist(), [0, 0, 0, 2, 3, 3, 3])
+        self.assertEqual(expanded['VARIANT'].tolist(), ['B1', '81', 'BI', 'XY', 'B1', '81', 'BI'])
 
 
 class TestRateAssign520(TestCase):
@@ -122,6 +143,82 @@ class TestAVIValidation(TestCase):
         df_errors = df_errors[df_errors['AVI_MISMATCH'] == True]
         self.assertEqual(df_errors.empty, True)
 
+    def test_plate_index(self):
+        df = pd.DataFrame({'TRX_ID': range(8), 'TAG_ID': [123] * 6 + [321, 217],
+                           'PLATE': ['A8C'] * 6 + ['4BC', 'DF']})
+        avi_validation = td.AVIValidation(plate_tag_dict_name={}, dataframe=df, export_dict=False,
+                                          exact_plates=False, plate_index=True)
+        avi_validation.find_and_mark_missed_avi_reads()
+        df_errors = avi_validation.get_dataframe()
+        self.assertEqual(df_errors.loc[df_errors['AVI_MISMATCH'], 'TRX_ID'].tolist(), [6])
+        self.assertEqual(sorted(avi_validation.get_plate_tag_dict().keys()), ['4BC', 'A8C', 'DF'])
+
+    def test_static_dict_plate_combinations(self):
+        df = pd.DataFrame({'TRX_ID': range(5), 'TAG_ID': [123, 999, 456, 789, float('nan')],
+                           'PLATE': ['A8C', 'ABC', 'DEF', 'XYZ', 'DEF']})
+        plate_tag_dict = {'A8C': [123, 5], 'ABC': [999, 5], 'DEF': [456, 5]}
+        avi_validation = td.AVIValidation(plate_tag_dict_name=plate_tag_dict, dataframe=df,
+                                          static_dict=True, exact_plates=False, export_dict=False)
+        avi_validation.find_and_mark_missed_avi_reads()
+        df_errors = avi_validation.get_dataframe()
+        self.assertEqual(df_errors.loc[df_errors['AVI_MISMATCH'], 'TRX_ID'].tolist(), [0, 1, 4])
+        self.assertEqual(sorted(avi_validation.get_plate_tag_dict().keys()), ['A8C', 'ABC', 'DEF'])
+        self.assertEqual(avi_validation.get_plate_tag_dict()['A8C'][1], 6)
+
+
+class TestPlateTrie(TestCase):
+    def test_search_combinations(self):
+        trie = td.PlateTrie(['B8B', 'BBB', '888', 'XYZ', 'BB', '', None, 'BBB'])
+        self.assertEqual(len(trie), 5)
+        self.assertEqual(trie.search_combinations('BBB'), ['BBB', 'B8B', '888'])
+        self.assertEqual(trie.search_combinations('BBB', max_substitutions=1), ['BBB', 'B8B'])
+        self.assertEqual(trie.search_combinations('BBX'), [])
+        self.assertTrue('BB' in trie)
+        self.assertFalse('B' in trie)
+
+    def test_matches_plate_combinatorics(self):
+        plates = ['DOS1', 'OQS1', 'O0S1', 'OOSI', 'QQ51', 'OQ5I']
+        trie = td.PlateTrie(plates)
+        for plate in plates:
+            expected = [i for i in td.PlateCombinatorics(plate).get_plate_combinations() if i in plates]
+            combinations = td.PlateCombinatorics(plate).get_plate_combinations(known_plates=trie)
+            self.assertEqual(sorted(combinations), sorted(expected))
+
+
+class TestOCRPlateIndex(TestCase):
+    def test_one_way_substitution(self):
+        index = td.OCRPlateIndex(['DB1', 'OB1', 'QB1', 'O81', 'XYZ', '', None])
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.canonical_key('DB1'), index.canonical_key('Q8I'))
+        self.assertEqual(sorted(index.get_compatible('DB1')), ['DB1', 'O81', 'OB1'])
+        self.assertEqual(sorted(index.get_compatible('OB1')), ['O81', 'OB1', 'QB1'])
+        self.assertEqual(index.get_compatible('ABC'), [])
+
+    def test_match_series_matches_expansion(self):
+        plates = pd.Series(['DB1', 'OB1', None, 'XYZ', 'Q8I', 'DB1'])
+        expanded = td.PlateCombinatorics.expand_series(plates)
+        expected = expanded[expanded['VARIANT'].isin(plates)].sort_values(['ROW', 'VARIANT'])
+        matched = td.OCRPlateIndex(plates).match_series(plates).sort_values(['ROW', 'VARIANT'])
+        self.assertEqual(matched.values.tolist(), expected.values.tolist())
+
+
+class TestFuzzyPlateIndex(TestCase):
+    def test_search_ranked(self):
+        index = td.FuzzyPlateIndex(['ABC123', 'ABC12', 'A8C123', 'XBC123', 'ZZZ999', None],
+                                   max_distance=1)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.search('ABC123'),
+                         [('ABC123', 0), ('A8C123', 0.5), ('ABC12', 1), ('XBC123', 1)])
+        self.assertEqual(index.search('ABCI23', max_distance=0.5), [('ABC123', 0.5)])
+        self.assertEqual(index.search('ABC1234'), [('ABC123', 1)])
+        self.assertEqual(index.search(''), [])
+
+    def test_two_edits(self):
+        index = td.FuzzyPlateIndex(['ABC123'], max_distance=2)
+        self.assertEqual(index.search('BC12'), [('ABC123', 2)])
+        self.assertEqual(index.search('8C12'), [])
+        self.assertEqual(index.distance('8C12', 'ABC123'), 2.5)
+
 
 class TestRateAssign99(TestCase):
     _holiday_list = [datetime.date(2020, 7, 3),
@@ -176,3 +273,504 @@ class TestRateAssign99(TestCase):
                              holidays=self._holiday_list,
                              rate_file='toll_rates_99.json').get_final_rate()
         self.assertEqual(rate, 6.4)
+
+
+class TestAVITest(TestCase):
+    def get_test_dataframe(self, days=40, miss_every=5):
+        start = datetime.datetime(2021, 3, 1)
+        trx_id, times, tags, plates = [], [], [], []
+        for day in range(days):
+            for c, (plate, tag) in enumerate([('ABC', 123), ('DEF', 456), ('GHI', 789)]):
+                for read in range(3):
+                    trx_id.append(len(trx_id))
+                    times.append(start + datetime.timedelta(days=day, hours=c, minutes=read))
+                    plates.append(plate)
+                    # the first 'ABC' tag read is missed every miss_every days
+                    tags.append(float('nan') if plate == 'ABC' and day % miss_every == 0
+                                and read == 0
+                                else tag)
+        return pd.DataFrame({'TRX_ID': trx_id, 'DATETIME': times,
+                             'TAG_ID': tags, 'PLATE': plates})
+
+    def test_run_trials_sampled(self):
+        avi_test = td.AVITest(dataframe=self.get_test_dataframe())
+        summary = avi_test.run_trials(n_trials=4, processes=1, random_state=1)
+        results = avi_test.get_trial_results()
+        self.assertEqual(summary['n_trials'], 4)
+        self.assertEqual(results.shape[0], 4)
+        self.assertTrue(summary['worst_result'] <= summary['mean'] < 1)
+        self.assertTrue(summary['ci_low'] <= summary['mean'] <= summary['ci_high'])
+
+    def test_run_trials_all_windows_process_pool(self):
+        df = self.get_test_dataframe()
+        df['Plaza'] = 'NB01'
+        avi_test = td.AVITest(dataframe=df)
+        summary = avi_test.run_trials(all_windows=True, processes=2)
+        self.assertEqual(summary['n_trials'], 10)
+        worst = avi_test.get_trial_results()['RESULT'].min()
+        self.assertEqual(summary['worst_result'], worst)
+        results = avi_test.get_trial_results()['RESULT'].tolist()
+        avi_test.run_trials(all_windows=True, processes=1)
+        self.assertEqual(avi_test.get_trial_results()['RESULT'].tolist(), results)
+
+    def test_unsorted_dataframe_windows(self):
+        df = self.get_test_dataframe()
+        sorted_test = td.AVITest(dataframe=df)
+        shuffled_test = td.AVITest(dataframe=df.sample(frac=1, random_state=3))
+        sorted_test.run_trials(all_windows=True, processes=1)
+        shuffled_test.run_trials(all_windows=True, processes=1)
+        self.assertEqual(sorted_test.get_trial_results()['RESULT'].tolist(),
+                         shuffled_test.get_trial_results()['RESULT'].tolist())
+
+    def test_import_data_range(self):
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            for c in range(3):
+                write_trip_file(os.path.join(directory, 'TripTxn_' + str(c) + '.csv'),
+                                datetime.datetime(2021, 3, 1 + c), 1, trx_start=100 * c)
+            os.chdir(directory)
+            try:
+                avi_test = td.AVITest()
+                avi_test.set_data_range(datetime.datetime(2021, 3, 2), datetime.datetime(2021, 3, 2, 23))
+                avi_test._AVITest__import_analysis_files()
+            finally:
+                os.chdir(working_directory)
+            days = avi_test._df_full['DATETIME'].dt.day
+            self.assertEqual(days.unique().tolist(), [2])
+            self.assertEqual(avi_test._df_full.shape[0], 24)
+            with self.assertRaises(ValueError):
+                avi_test.set_data_range(datetime.datetime(2021, 3, 2), datetime.datetime(2021, 3, 1))
+
+    def test_rolling_analysis(self):
+        avi_test = td.AVITest(dataframe=self.get_test_dataframe(miss_every=7))
+        result = avi_test.run_rolling_analysis()
+        self.assertEqual(result.shape[0], 11)
+        for start in range(result.shape[0]):
+            # the first training read of 'ABC' is missed, so it has no dictionary tag
+            misses = 0 if start % 7 == 0 else \
+                sum(1 for day in range(start + 15, start + 30) if day % 7 == 0)
+            self.assertAlmostEqual(result.iloc[start], 1 - misses / 135)
+
+    def test_rolling_analysis_matches_run_trials_n_plates(self):
+        df = self.get_test_dataframe(days=40, miss_every=4)
+        # 'GHI' misses a read every third day, and 'DEF' has the most reads
+        df.loc[(df['PLATE'] == 'GHI') & (df['DATETIME'].dt.day % 3 == 0) &
+               (df['DATETIME'].dt.minute == 1), 'TAG_ID'] = float('nan')
+        df['DATETIME'] = df['DATETIME'] + datetime.timedelta(minutes=1)
+        df = pd.concat([pd.DataFrame({'TRX_ID': [-1], 'DATETIME': [datetime.datetime(2021, 3, 1)],
+                                      'TAG_ID': [999.0], 'PLATE': ['XYZ']}), df], ignore_index=True)
+        results = {}
+        for n_plates in [0, 2]:
+            avi_test = td.AVITest(dataframe=df, n_plates=n_plates)
+            avi_test.run_trials(all_windows=True, processes=1)
+            trials = avi_test.get_trial_results()['RESULT'].tolist()
+            rolling = avi_test.run_rolling_analysis().tolist()[:len(trials)]
+            for i, j in zip(rolling, trials):
+                self.assertAlmostEqual(i, j)
+            results[n_plates] = rolling
+        self.assertNotEqual(results[0], results[2])
+
+    def test_rolling_analysis_matches_run_analysis(self):
+        df = self.get_test_dataframe(days=31, miss_every=4)
+        df.loc[0, 'TAG_ID'] = 123
+        # no reads on the window boundaries, which run_analysis includes in both halves
+        df['DATETIME'] = df['DATETIME'] + datetime.timedelta(minutes=1)
+        # 'MNO' has one read less than the threshold after its first read
+        days = [0, 1, 2, 3, 4, 20, 21]
+        df_extra = pd.DataFrame({'TRX_ID': [-1] + [-2 - i for i in days],
+                                 'DATETIME': [datetime.datetime(2021, 3, 1)] +
+                                 [datetime.datetime(2021, 3, 1 + i, 5) for i in days],
+                                 'TAG_ID': [999.0] + [555.0] * 5 + [float('nan')] * 2,
+                                 'PLATE': ['XYZ'] + ['MNO'] * 7})
+        df = pd.concat([df_extra, df], ignore_index=True)
+        avi_test = td.AVITest(dataframe=df)
+        avi_test.run_analysis()
+        result = avi_test.run_rolling_analysis()
+        self.assertTrue(avi_test.get_test_result() < 1)
+        self.assertAlmostEqual(result.iloc[0], avi_test.get_test_result())
+
+
+def write_trip_file(filename, start, days, trx_start=0):
+    """
+    Write a small trip export csv with one row per hour
+    """
+    rows = ['Trip Export', 'id,Trx ID,Plaza,plate,Ag-Tag,Entry Time']
+    for i in range(days * 24):
+        entry_time = start + datetime.timedelta(hours=i)
+        rows.append(','.join([str(i), str(trx_start + i), 'NB0' + str(i % 5 + 1),
+                              'ABC' + str(i % 7) + '-WA', '1-' + str(100 + i % 7),
+                              entry_time.strftime('%m/%d/%Y %H:%M:%S')]))
+    with open(filename, 'w') as f:
+        f.write('\n'.join(rows) + '\n')
+
+
+class TestTripDataCache(TestCase):
+    def test_update_and_read_window(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_1 = os.path.join(directory, 'TripTxn_1.csv')
+            file_2 = os.path.join(directory, 'TripTxn_2.csv')
+            write_trip_file(file_1, datetime.datetime(2021, 3, 1), 3)
+            write_trip_file(file_2, datetime.datetime(2021, 3, 4), 2, trx_start=1000)
+            cache = td.TripDataCache(os.path.join(directory, 'cache'))
+            self.assertEqual(cache.update([file_1, file_2]), [file_1, file_2])
+            self.assertEqual(cache.update([file_1, file_2]), [])
+
+            df = cache.read(start=datetime.datetime(2021, 3, 3, 12),
+                            end=datetime.datetime(2021, 3, 4, 5), columns=['TRX_ID', 'TAG_ID'])
+            self.assertEqual(list(df.columns), ['TRX_ID', 'TAG_ID'])
+            self.assertEqual(df.shape[0], 18)
+            self.assertEqual(cache.read().shape[0], 120)
+
+    def test_changed_file_is_parsed_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_1 = os.path.join(directory, 'TripTxn_1.csv')
+            write_trip_file(file_1, datetime.datetime(2021, 3, 1), 3)
+            cache = td.TripDataCache(os.path.join(directory, 'cache'))
+            cache.update([file_1])
+            time.sleep(0.01)
+            write_trip_file(file_1, datetime.datetime(2021, 3, 2), 1)
+
+            reopened = td.TripDataCache(os.path.join(directory, 'cache'))
+            self.assertEqual(reopened.update([file_1]), [file_1])
+            df = reopened.read()
+            self.assertEqual(df.shape[0], 24)
+            self.assertEqual(df['DATETIME'].dt.day.unique().tolist(), [2])
+
+    def test_removed_file_is_pruned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_1 = os.path.join(directory, 'TripTxn_1.csv')
+            file_2 = os.path.join(directory, 'TripTxn_2.csv')
+            write_trip_file(file_1, datetime.datetime(2021, 3, 1), 1)
+            write_trip_file(file_2, datetime.datetime(2021, 3, 2), 1, trx_start=1000)
+            cache = td.TripDataCache(os.path.join(directory, 'cache'))
+            cache.update([file_1, file_2])
+            os.remove(file_1)
+
+            self.assertEqual(cache.update([file_2]), [])
+            self.assertEqual(list(cache.get_manifest().keys()), [file_2])
+            self.assertEqual(cache.read().shape[0], 24)
+            self.assertFalse(os.listdir(os.path.join(directory, 'cache', '2021-03-01')))
+
+    def test_update_from_other_working_directory(self):
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            file_1 = os.path.join(directory, 'TripTxn_1.csv')
+            file_2 = os.path.join(directory, 'TripTxn_2.csv')
+            write_trip_file(file_1, datetime.datetime(2021, 3, 1), 1)
+            write_trip_file(file_2, datetime.datetime(2021, 3, 2), 1, trx_start=1000)
+            os.chdir(directory)
+            try:
+                cache = td.TripDataCache('cache')
+                self.assertEqual(cache.update(['TripTxn_1.csv']), ['TripTxn_1.csv'])
+            finally:
+                os.chdir(working_directory)
+
+            self.assertEqual(cache.update([file_1, file_2]), [file_2])
+            self.assertEqual(sorted(cache.get_manifest().keys()),
+                             [os.path.abspath(file_1), os.path.abspath(file_2)])
+            self.assertEqual(td.TripDataCache(os.path.join(directory, 'cache')).read().shape[0], 48)
+
+
+class TestParallelFileReader(TestCase):
+    def test_read_with_failed_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, 'TripTxn_' + str(i) + '.csv') for i in range(3)]
+            for c, filename in enumerate(filenames):
+                write_trip_file(filename, datetime.datetime(2021, 3, 1 + c), 1, trx_start=100 * c)
+            bad_filename = os.path.join(directory, 'TripTxn_bad.txt')
+            write_trip_file(bad_filename, datetime.datetime(2021, 3, 5), 1)
+
+            reader = td.ParallelFileReader(filenames + [bad_filename], file_class=td.TripFile,
+                                           processes=2, max_in_flight=1, show_progress=False)
+            df = reader.read()
+            self.assertEqual(df.shape[0], 72)
+            self.assertEqual(df['TRX_ID'].tolist()[:3], [0, 1, 2])
+            self.assertEqual(list(reader.get_errors().keys()), [bad_filename])
+
+
+class TestTransactionFile(TestCase):
+    def test_chunks_match_full_read(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'TripTxn_1.csv')
+            write_trip_file(filename, datetime.datetime(2021, 3, 1), 2)
+            df_full = td.TripFile(filename).get_df()
+            chunks = list(td.TripFile(filename, chunksize=10).iter_chunks())
+
+            self.assertEqual([i.shape[0] for i in chunks], [10, 10, 10, 10, 8])
+            df_chunks = pd.concat(chunks)
+            for field in ['PLATE', 'TAG_ID', 'AG', 'TRX_ID']:
+                self.assertEqual(df_full[field].tolist(), df_chunks[field].tolist())
+
+    def test_chunk_without_tags_or_plates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'TripTxn_1.csv')
+            rows = ['Trip Export', 'id,Trx ID,Plaza,plate,Ag-Tag,Entry Time']
+            for i in range(8):
+                plate, tag = ('ABC1-WA', '1-100') if i < 4 else ('', '')
+                rows.append(','.join([str(i), str(i), 'NB01', plate, tag,
+                                      '03/01/2021 08:0' + str(i) + ':00']))
+            with open(filename, 'w') as f:
+                f.write('\n'.join(rows) + '\n')
+            chunks = list(td.TripFile(filename, chunksize=4).iter_chunks())
+
+            self.assertEqual([i.shape[0] for i in chunks], [4, 4])
+            self.assertEqual(chunks[0]['TAG_ID'].tolist(), [100] * 4)
+            self.assertTrue(chunks[1]['TAG_ID'].isna().all())
+            self.assertTrue(chunks[1]['PLATE'].isna().all())
+            for field in ['TAG_ID', 'AG', 'TRX_ID']:
+                self.assertEqual(chunks[0][field].dtype, chunks[1][field].dtype)
+
+    def test_csv_header_and_layout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'TripTxn_1.csv')
+            write_trip_file(filename, datetime.datetime(2021, 3, 1), 1)
+            trip_file = td.TripFile(filename, usecols=['Entry Time'])
+            df = trip_file.get_df()
+
+            self.assertEqual(trip_file._header_row, 1)
+            self.assertEqual(df.shape[0], 24)
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['Entry Time']))
+            self.assertTrue('Plaza' not in df.columns)
+            self.assertEqual(df['TAG_ID'].iloc[0], 100)
+
+    def test_csv_header_after_long_preamble(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'TripTxn_1.csv')
+            write_trip_file(filename, datetime.datetime(2021, 3, 1), 1)
+            with open(filename) as f:
+                rows = f.read()
+            with open(filename, 'w') as f:
+                f.write(('Export note ' * 10 + '\n') * 1000 + rows)
+            trip_file = td.TripFile(filename)
+            self.assertEqual(trip_file._header_row, 1001)
+            self.assertEqual(trip_file.get_df().shape[0], 24)
+
+            with open(filename, 'w') as f:
+                f.write('Trip Export\n1,2,3\n')
+            with self.assertRaises(ValueError):
+                td.TripFile(filename)
+
+    def test_excel_single_pass(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'lane_report.xlsx')
+            workbook = openpyxl.Workbook()
+            worksheet = workbook.active
+            worksheet.title = 'TrxnDetail'
+            worksheet.append(['Lane Report'])
+            worksheet.append(['Trx ID', 'CSC Lane', 'Trx Time', 'Ocr Info', 'Ag', 'Number'])
+            for i in range(25):
+                worksheet.append([i, 'NB01', datetime.datetime(2021, 3, 1, 8, i),
+                                  'ABC' + str(i % 4) + '-WA', 1, 1000 + i % 4])
+            worksheet.append([None] * 6)
+            worksheet.append([25, 'NB02', datetime.datetime(2021, 3, 1, 9), None, None, None])
+            worksheet.append([None] * 6)
+            workbook.save(filename)
+
+            df = td.TransactionFile(filename).get_df()
+            df_expected = pd.read_excel(filename, sheet_name='TrxnDetail', skiprows=1)
+            self.assertEqual(df.shape[0], df_expected.shape[0])
+            self.assertEqual(df['Trx Time'].tolist(), df_expected['Trx Time'].tolist())
+            self.assertEqual(df['PLATE'].tolist()[:25], ['ABC' + str(i % 4) for i in range(25)])
+            self.assertEqual(df['TAG_ID'].tolist()[:2], [1000, 1001])
+
+            chunks = list(td.TransactionFile(filename, chunksize=10).iter_chunks())
+            self.assertEqual([i.shape[0] for i in chunks], [10, 10, 7])
+            self.assertEqual(pd.concat(chunks)['TRX_ID'].fillna(-1).tolist(),
+                             df['TRX_ID'].fillna(-1).tolist())
+            chunks = list(td.TransactionFile(filename, chunksize=26).iter_chunks())
+            self.assertEqual([i.shape[0] for i in chunks], [26, 1])
+
+
+class TestTransactionSchema(TestCase):
+    def test_apply(self):
+        df = pd.DataFrame({'TRX_ID': [1, 2, 3, 4], 'PLATE': ['ABC', 'ABC', 'DEF', 'ABC'],
+                           'TAG_ID': [1234.0, float('nan'), 5678.0, 1234.0],
+                           'AG': [1, 1, 2, 1], 'Plaza': ['NB01', 'NB01', 'NB02', 'NB01'],
+                           'DATETIME': ['2021-03-01 08:00', '2021-03-01 08:01',
+                                        '2021-03-01 08:02', '2021-03-01 08:03']})
+        compact = td.TransactionSchema.apply(df)
+        self.assertEqual(str(compact['TAG_ID'].dtype), 'Int16')
+        self.assertEqual(str(compact['AG'].dtype), 'Int8')
+        self.assertEqual(str(compact['PLATE'].dtype), 'category')
+        self.assertEqual(str(compact['Plaza'].dtype), 'category')
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(compact['DATETIME']))
+        self.assertTrue(compact['TAG_ID'].isna().iloc[1])
+
+    def test_non_integer_field_unchanged(self):
+        df = pd.DataFrame({'TRX_ID': ['A1', 'A2'], 'TAG_ID': [1.5, 2.0]})
+        compact = td.TransactionSchema.apply(df)
+        self.assertEqual(compact['TRX_ID'].tolist(), ['A1', 'A2'])
+        self.assertEqual(compact['TAG_ID'].tolist(), [1.5, 2.0])
+
+    def test_avi_validation_compact(self):
+        df = td.TransactionSchema.apply(TestAVIValidation._df)
+        avi_validation = td.AVIValidation(dataframe=df, export_dict=False)
+        avi_validation.find_and_mark_missed_avi_reads()
+        df_errors = avi_validation.get_dataframe()
+        df_errors = df_errors[df_errors['AVI_MISMATCH'] == True]
+        self.assertEqual(df_errors['TRX_ID'].tolist(), [5375])
+
+
+class TestPlateTagRegistry(TestCase):
+    def test_encode_and_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'registry.pkl')
+            registry = td.PlateTagRegistry(filename)
+            plate_ids = registry.encode_plates(pd.Series(['ABC', 'DEF', '', None, 'ABC']))
+            tag_ids = registry.encode_tags(pd.Series([1234.0, float('nan'), 5678.0]))
+            self.assertEqual(plate_ids.tolist(), [0, 1, -1, -1, 0])
+            self.assertEqual(str(plate_ids.dtype), 'int32')
+            self.assertEqual(tag_ids.tolist(), [0, -1, 1])
+            registry.save()
+
+            reloaded = td.PlateTagRegistry(filename)
+            plate_ids = reloaded.encode_plates(pd.Series(['GHI', 'DEF']))
+            tag_ids = reloaded.encode_tags(pd.Series([5678, 1234], dtype='Int32'))
+            self.assertEqual(plate_ids.tolist(), [2, 1])
+            self.assertEqual(tag_ids.tolist(), [1, 0])
+            self.assertEqual(reloaded.decode_plates(np.array([1, -1])).tolist(), ['DEF', None])
+
+
+class TestTransactionDeduplicator(TestCase):
+    def test_large_integer_ids(self):
+        ids = [2 ** 53, 2 ** 53 + 1, 2 ** 62 + 1, 2 ** 62 + 2]
+        self.assertEqual(len(set(td.TransactionDeduplicator.hash_ids(pd.Series(ids)).tolist())), 4)
+        deduplicator = td.TransactionDeduplicator()
+        df = deduplicator.filter(pd.DataFrame({'TRX_ID': pd.Series(ids + [None], dtype='Int64')}))
+        self.assertEqual(df.shape[0], 5)
+        df = deduplicator.filter(pd.DataFrame({'TRX_ID': pd.Series(ids[1:], dtype='int64')}))
+        self.assertEqual(df.shape[0], 0)
+        df = deduplicator.filter(pd.DataFrame({'TRX_ID': [float(2 ** 53), float(2 ** 62)]}))
+        self.assertEqual(df.shape[0], 1)
+
+    def test_filter_and_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'trx_id_index.npy')
+            deduplicator = td.TransactionDeduplicator(filename)
+            df = deduplicator.filter(pd.DataFrame({'TRX_ID': [1, 2, 2, None, None]}), source='a')
+            self.assertEqual(df.index.tolist(), [0, 1, 3, 4])
+            df = deduplicator.filter(pd.DataFrame({'TRX_ID': pd.Series([2, 3], dtype='Int32')}),
+                                     source='b')
+            self.assertEqual(df['TRX_ID'].tolist(), [3])
+            self.assertEqual(deduplicator.get_duplicate_counts(), {'a': 1, 'b': 1})
+            deduplicator.save()
+
+            reloaded = td.TransactionDeduplicator(filename)
+            self.assertEqual(reloaded.get_id_count(), 3)
+            df = reloaded.filter(pd.DataFrame({'TRX_ID': [3.0, 4.0]}), source='c')
+            self.assertEqual(df['TRX_ID'].tolist(), [4.0])
+
+    def test_missing_id_before_zero(self):
+        deduplicator = td.TransactionDeduplicator()
+        df = deduplicator.filter(pd.DataFrame({'TRX_ID': [None, 0, None, 0]}))
+        self.assertEqual(df.index.tolist(), [0, 1, 2])
+
+    def test_pending_hashes_merged(self):
+        deduplicator = td.TransactionDeduplicator()
+        deduplicator._min_merge_size = 4
+        for i in range(5):
+            deduplicator.filter(pd.DataFrame({'TRX_ID': [2 * i, 2 * i + 1]}), source='a')
+        df = deduplicator.filter(pd.DataFrame({'TRX_ID': list(range(12))}), source='b')
+        self.assertEqual(df['TRX_ID'].tolist(), [10, 11])
+        self.assertEqual(deduplicator.get_id_count(), 12)
+        self.assertEqual(deduplicator.get_duplicate_counts(), {'a': 0, 'b': 10})
+
+    def test_overlapping_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, 'TripTxn_' + str(i) + '.csv') for i in range(2)]
+            write_trip_file(filenames[0], datetime.datetime(2021, 3, 1), 1)
+            write_trip_file(filenames[1], datetime.datetime(2021, 3, 1), 1, trx_start=12)
+
+            reader = td.ParallelFileReader(filenames, file_class=td.TripFile, show_progress=False)
+            deduplicator = td.TransactionDeduplicator()
+            self.assertEqual(reader.read(deduplicator).shape[0], 36)
+            self.assertEqual(deduplicator.get_duplicate_counts(), {filenames[0]: 0, filenames[1]: 12})
+
+            cache = td.TripDataCache(os.path.join(directory, 'cache'))
+            cache.update(filenames)
+            df = cache.read(columns=['PLATE'], deduplicator=td.TransactionDeduplicator())
+            self.assertEqual(df.shape[0], 36)
+            self.assertEqual(list(df.columns), ['PLATE'])
+
+
+class TestIngestionService(TestCase):
+    def test_ingest_once_and_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            drop_directory = os.path.join(directory, 'drop')
+            cache_directory = os.path.join(directory, 'cache')
+            os.makedirs(drop_directory)
+            write_trip_file(os.path.join(drop_directory, 'TripTxn_1.csv'),
+                            datetime.datetime(2021, 3, 1), 1)
+            write_trip_file(os.path.join(drop_directory, 'notes.txt'),
+                            datetime.datetime(2021, 3, 1), 1)
+            received = []
+            service = td.IngestionService(drop_directory, td.TripDataCache(cache_directory),
+                                          settle_seconds=0)
+            service.add_stage(lambda df: received.append(df.shape[0]))
+            self.assertEqual(len(service.poll()), 1)
+            self.assertEqual(service.poll(), [])
+            self.assertEqual(received, [24])
+
+            # restart resumes from the cache manifest
+            restarted = td.IngestionService(drop_directory, td.TripDataCache(cache_directory),
+                                            settle_seconds=0)
+            restarted.add_stage(lambda df: received.append(df.shape[0]))
+            self.assertEqual(restarted.poll(), [])
+            write_trip_file(os.path.join(drop_directory, 'TripTxn_2.csv'),
+                            datetime.datetime(2021, 3, 2), 2)
+            restarted.run(max_polls=1)
+            self.assertEqual(received, [24, 48])
+            self.assertEqual(td.TripDataCache(cache_directory).read().shape[0], 72)
+
+    def test_directory_with_dots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            drop_directory = os.path.join(directory, 'drop.v1')
+            os.makedirs(drop_directory)
+            write_trip_file(os.path.join(drop_directory, 'TripTxn_2021.03.01.csv'),
+                            datetime.datetime(2021, 3, 1), 1)
+            service = td.IngestionService(drop_directory, td.TripDataCache(os.path.join(directory, 'cache')),
+                                          settle_seconds=0)
+            self.assertEqual(len(service.poll()), 1)
+            self.assertEqual(service.get_failed_files(), {})
+
+    def test_deduplicate_before_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            drop_directory = os.path.join(directory, 'drop')
+            cache_directory = os.path.join(directory, 'cache')
+            os.makedirs(drop_directory)
+            first_filename = os.path.join(drop_directory, 'TripTxn_1.csv')
+            write_trip_file(first_filename, datetime.datetime(2021, 3, 1), 1)
+            write_trip_file(os.path.join(drop_directory, 'TripTxn_2.csv'),
+                            datetime.datetime(2021, 3, 1), 1, trx_start=12)
+            received = []
+            service = td.IngestionService(drop_directory, td.TripDataCache(cache_directory),
+                                          settle_seconds=0, deduplicator=td.TransactionDeduplicator())
+            service.add_stage(lambda df: received.append(df.shape[0]))
+            service.poll()
+            self.assertEqual(received, [36])
+            self.assertEqual(td.TripDataCache(cache_directory).read().shape[0], 36)
+
+            # a changed file keeps the transactions cached for its previous version
+            write_trip_file(first_filename, datetime.datetime(2021, 3, 1), 2)
+            os.utime(first_filename, ns=(0, 0))
+            service.poll()
+            self.assertEqual(received, [36, 36])
+            self.assertEqual(td.TripDataCache(cache_directory).read().shape[0], 48)
+
+
+class TestAsyncFileReader(TestCase):
+    def test_read_matches_parallel_reader(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, 'TripTxn_' + str(i) + '.csv') for i in range(4)]
+            for c, filename in enumerate(filenames):
+                write_trip_file(filename, datetime.datetime(2021, 3, 1 + c), 1, trx_start=100 * c)
+            missing_filename = os.path.join(directory, 'TripTxn_missing.csv')
+
+            reader = td.AsyncFileReader(filenames + [missing_filename], file_class=td.TripFile,
+                                        processes=2, queue_size=1)
+            df = reader.read()
+            df_expected = td.ParallelFileReader(filenames, file_class=td.TripFile, processes=1,
+                                                show_progress=False).read()
+            self.assertEqual(df['TRX_ID'].tolist(), df_expected['TRX_ID'].tolist())
+            self.assertEqual(df['PLATE'].tolist(), df_expected['PLATE'].tolist())
+            self.assertEqual(list(reader.get_errors().keys()), [missing_filename])
@@ -4,6 +4,7 @@ sys.path.append(os.getcwd() + '\\tolldata')
 from unittest import TestCase
 import pandas as pd
 import datetime
+import numpy as np
 
 # PyCharm Tests, uncomment to run
 # from tolldata import TravelTime as tt
@@ -68,6 +69,124 @@ class TestTravelTime(TestCase):
 
         self.assertAlmostEquals(calculated_travel_time, 60, places=0)
 
+    def test_od_matrix_matches_routes(self):
+        travel_time = self.create_test_dataframe()
+        corridor = ['NB01', 'NB03', 'NB04', 'NB07', 'NB08', 'NB09', 'NB10']
+        od_matrix = travel_time.get_travel_time_od_matrix(corridor)
+        self.assertEqual(od_matrix.shape, (7, 7, 1440))
+        self.assertTrue(np.isnan(od_matrix[3, 1, 0]))
+        self.assertEqual(od_matrix[2, 2, 0], 0)
+        for minute in [4, 5, 30, 600]:
+            start_time = self.TEST_DATETIME + datetime.timedelta(minutes=minute)
+            for origin, destination in [(0, 1), (0, 6), (1, 4), (2, 6)]:
+                expected = travel_time.get_travel_time(start_time, corridor[origin:destination + 1])
+                self.assertAlmostEqual(od_matrix[origin, destination, minute], expected, places=6)
+
+    def test_batch_travel_times(self):
+        travel_time = self.create_test_dataframe()
+        routes = [['NB01', 'NB03'], ['NB03', 'NB04', 'NB07'], ['NB01', 'NB03'], ['NB09', 'NB10']]
+        start_times = [self.TEST_DATETIME + datetime.timedelta(minutes=i) for i in [4, 6, 700, 9]]
+        result = travel_time.get_travel_times(start_times, routes)
+        for c, route in enumerate(routes):
+            self.assertAlmostEqual(result[c], travel_time.get_travel_time(start_times[c], route), places=6)
+
+        # cached profile is reused, and replaced when the travel times change
+        profile = travel_time.get_route_profile(['NB01', 'NB03'])
+        self.assertIs(travel_time.get_route_profile(['NB01', 'NB03']), profile)
+        travel_time.df_travel_time = travel_time.df_travel_time * 2
+        self.assertAlmostEqual(travel_time.get_route_profile(['NB01', 'NB03'])[4], profile[4] * 2)
+
+    def test_default_topology(self):
+        df = pd.DataFrame({'TRIP_ID': [1, 1], 'PLAZA': ['NB01', 'NB03'],
+                           'DATETIME': [self.TEST_DATETIME + datetime.timedelta(minutes=5),
+                                        self.TEST_DATETIME + datetime.timedelta(minutes=8)]})
+        travel_time = tt.TravelTime(df, plaza_field_name='PLAZA', trip_field_name='TRIP_ID')
+        self.assertAlmostEqual(travel_time.df_travel_time['NB01-NB03'].iloc[0], 15492 * 3600 / 65 / 5280,
+                               places=3)
+
+    def test_unknown_pair(self):
+        travel_time = self.create_test_dataframe()
+        with self.assertRaises(KeyError):
+            travel_time.get_travel_time_all_day(['NB01', 'NB02'])
+        with self.assertRaises(KeyError):
+            travel_time.get_route_profile(['NB03', 'NB04', 'NB02'])
+        result = travel_time.get_travel_times([self.TEST_DATETIME] * 2, [['NB01', 'NB02'], ['NB01', 'NB03']])
+        self.assertTrue(np.isnan(result[0]))
+        self.assertFalse(np.isnan(result[1]))
+
+    def test_reliability_metrics(self):
+        t1 = self.TEST_DATETIME + datetime.timedelta(minutes=10)
+        t2 = self.TEST_DATETIME + datetime.timedelta(minutes=400)
+        df = pd.DataFrame({'TRIP_ID': [1, 1, 2, 2, 3, 3],
+                           'PLAZA': ['NB01', 'NB03', 'NB01', 'NB03', 'NB01', 'NB03'],
+                           'DATETIME': [t1, t1 + datetime.timedelta(seconds=60),
+                                        t1, t1 + datetime.timedelta(seconds=120),
+                                        t2, t2 + datetime.timedelta(seconds=180)]})
+        travel_time = tt.TravelTime(df, plaza_field_name='PLAZA', trip_field_name='TRIP_ID',
+                                    toll_locations={'NB01': 0, 'NB03': 1000})
+        trip = ['NB01', 'NB03']
+        metrics = travel_time.get_reliability_metrics(trip, bins=[0, 6, 12, 24], percentile=95)
+        self.assertEqual(metrics.index.tolist(), ['00:00-06:00', '06:00-12:00', '12:00-24:00'])
+        free_flow = 1000 * 3600 / 65 / 5280
+        self.assertAlmostEqual(metrics['FREE_FLOW'].iloc[0], free_flow, places=6)
+        self.assertEqual(metrics['TRIPS'].tolist(), [2, 1, 0])
+        self.assertAlmostEqual(metrics['MEAN'].iloc[0], 90, places=6)
+        self.assertAlmostEqual(metrics['TTI'].iloc[0], 90 / free_flow, places=6)
+        self.assertAlmostEqual(metrics['PTI'].iloc[1], 180 / free_flow, places=6)
+        self.assertAlmostEqual(metrics['BI'].iloc[1], 0, places=6)
+        self.assertTrue(metrics.iloc[2][['MEAN', 'PERCENTILE', 'TTI', 'PTI', 'BI']].isna().all())
+        with self.assertRaises(ValueError):
+            travel_time.get_reliability_metrics(trip, bins=[0, 12, 6])
+
+    def test_reliability_metrics_spread_within_minute(self):
+        t1 = self.TEST_DATETIME + datetime.timedelta(minutes=10)
+        df = pd.DataFrame({'TRIP_ID': [1, 1, 2, 2, 3, 3, 3],
+                           'PLAZA': ['NB01', 'NB03', 'NB01', 'NB03', 'NB01', 'NB03', 'NB04'],
+                           'DATETIME': [t1, t1 + datetime.timedelta(seconds=60),
+                                        t1, t1 + datetime.timedelta(seconds=120),
+                                        t1 + datetime.timedelta(minutes=400),
+                                        t1 + datetime.timedelta(minutes=401),
+                                        t1 + datetime.timedelta(minutes=402)]})
+        travel_time = tt.TravelTime(df, plaza_field_name='PLAZA', trip_field_name='TRIP_ID',
+                                    toll_locations={'NB01': 0, 'NB03': 1000, 'NB04': 2000})
+        metrics = travel_time.get_reliability_metrics(['NB01', 'NB03'], bins=[0, 6, 24], percentile=95)
+        self.assertEqual(metrics['TRIPS'].tolist(), [2, 1])
+        self.assertAlmostEqual(metrics['MEAN'].iloc[0], 90, places=6)
+        self.assertAlmostEqual(metrics['PERCENTILE'].iloc[0], 60 + 0.95 * 60, places=6)
+        self.assertTrue(metrics['BI'].iloc[0] > 0)
+
+        # the spread of the first pair is kept for longer routes
+        route = ['NB01', 'NB03', 'NB04']
+        metrics = travel_time.get_reliability_metrics(route, bins=[0, 6, 24], percentile=95)
+        profile = travel_time.get_route_profile(route)
+        minutes, offsets = travel_time._get_observed_trip_offsets('NB01-NB03')
+        self.assertEqual(offsets.tolist(), [-30, 30, 0])
+        self.assertAlmostEqual(metrics['MEAN'].iloc[0], profile[minutes[0]], places=6)
+        self.assertTrue(metrics['BI'].iloc[0] > 0)
+
+    def test_update_matches_full_build(self):
+        t1 = self.TEST_DATETIME + datetime.timedelta(minutes=5)
+        minute = datetime.timedelta(seconds=60)
+        df = pd.DataFrame({'TRIP_ID': [1, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5],
+                           'PLAZA': ['NB01', 'NB03', 'NB04', 'NB03', 'NB04', 'NB01', 'NB03',
+                                     'NB03', 'NB04', 'NB04', 'NB07'],
+                           'DATETIME': [t1, t1 + minute, t1 + 2 * minute, t1 + 200 * minute,
+                                        t1 + 203 * minute, t1 + 600 * minute, t1 + 602 * minute,
+                                        t1 + 100 * minute, t1 + 104 * minute, t1 + 300 * minute,
+                                        t1 + 301 * minute]})
+        locations = {'NB01': 0, 'NB03': 1000, 'NB04': 2000, 'NB07': 3000}
+        full = tt.TravelTime(df, plaza_field_name='PLAZA', trip_field_name='TRIP_ID',
+                             toll_locations=locations)
+        incremental = tt.TravelTime(df[df['TRIP_ID'] <= 2], plaza_field_name='PLAZA',
+                                    trip_field_name='TRIP_ID', toll_locations=locations)
+        profile = incremental.get_route_profile(['NB01', 'NB03', 'NB04'])
+        updated = incremental.update(df[df['TRIP_ID'] > 2])
+
+        self.assertEqual(sorted(updated), ['NB01-NB03', 'NB03-NB04', 'NB04-NB07'])
+        pd.testing.assert_frame_equal(incremental.df_travel_time[full.df_travel_time.columns],
+                                      full.df_travel_time)
+        self.assertFalse(np.array_equal(incremental.get_route_profile(['NB01', 'NB03', 'NB04']), profile))
+
     def create_test_dataframe(self) -> tt.TravelTime:
         # Add datetime data
         time_delta_minute = datetime.timedelta(seconds=60)
@@ -7,12 +7,14 @@ import pandas as pd
 import numpy as np
 import random
 import datetime
+import tempfile
 
 # PyCharm Tests, uncomment to run
 # from tolldata import TripBuilder as tb
 
 # Pytest, uncomment to run
 import TripBuilder as tb
+import CorridorTopology as ct
 
 class TestTripBuilder(TestCase):
     test_data_filename = os.getcwd() + '\\Tests\\trip_build_test_data.csv'
@@ -145,3 +147,85 @@ class TestTripBuilder(TestCase):
         df['DATETIME'] = pd.to_datetime(df['DATETIME'])
         df['TRANSPONDER_ID'] = df['TRANSPONDER_ID'].replace(0, np.nan)
         return df
+
+    def test_build_all_trips_compact_schema(self):
+        df = self.get_test_dataframe()
+        expected_trip_ids = df['TRIP_ID'].tolist()
+        df['TRANSPONDER_ID'] = tb.td.TransactionSchema.compact_integer(df['TRANSPONDER_ID'])
+        df = tb.td.TransactionSchema.apply(df)
+        exit_nodes = ['NB10', 'NB05', 'SB06', 'SB10', 'SB11']
+        build = tb.TripBuilder(df, exit_nodes=exit_nodes)
+        build.build_trips()
+        build_trip_ids = build.get_dataframe()['TRIP_ID_BUILD'].tolist()
+
+        self.assertEqual(expected_trip_ids, build_trip_ids)
+
+    def test_get_related_trips_registry(self):
+        expected_transactions = {8, 9, 10, 11, 12, 13}
+        df = self.get_test_dataframe()
+        with tempfile.TemporaryDirectory() as directory:
+            registry = tb.td.PlateTagRegistry(os.path.join(directory, 'registry.pkl'))
+            trip_build = tb.TripBuilder(df, registry=registry)
+            df_result = trip_build._get_related_trips(10)
+        result_transactions = set(df_result['TRANSACTION_ID'].tolist())
+        self.assertEqual(expected_transactions, result_transactions)
+
+    def test_build_all_trips_topology(self):
+        df = self.get_test_dataframe()
+        expected_trip_ids = df['TRIP_ID'].tolist()
+        topology = ct.CorridorTopology.from_json()
+        build = tb.TripBuilder(df, topology=topology)
+        build.build_trips()
+        build_trip_ids = build.get_dataframe()['TRIP_ID_BUILD'].tolist()
+
+        self.assertEqual(expected_trip_ids, build_trip_ids)
+
+    def test_impossible_speed_breaks_trip(self):
+        start = datetime.datetime(2021, 1, 1, 5)
+        minutes = [0, 5, 5, 10]
+        df = pd.DataFrame({'TRANSACTION_ID': [1, 2, 3, 4], 'PLAZA': ['NB01', 'NB03', 'NB04', 'NB05'],
+                           'DATETIME': [start + datetime.timedelta(minutes=i, seconds=10 * c)
+                                        for c, i in enumerate(minutes)],
+                           'PLATE': ['ABC123'] * 4, 'TRANSPONDER_ID': [np.nan] * 4, 'TRIP_ID': [0] * 4})
+        topology = ct.CorridorTopology([{'name': i, 'location_feet': 5280 * c, 'direction': 'NB'}
+                                        for c, i in enumerate(['NB01', 'NB03', 'NB04', 'NB05'])])
+        build = tb.TripBuilder(df, topology=topology)
+        build.build_trips(summary=True)
+        self.assertEqual(build.get_trip_ids().tolist(), [1, 1, 1, 1])
+        build = tb.TripBuilder(df, topology=topology, max_speed_mph=120)
+        build.build_trips(summary=True)
+        self.assertEqual(build.get_trip_ids().tolist(), [1, 1, 2, 2])
+
+    def test_trip_summary(self):
+        df = self.get_test_dataframe()
+        exit_nodes = ['NB10', 'NB05', 'SB06', 'SB10', 'SB11']
+        build = tb.TripBuilder(df, exit_nodes=exit_nodes)
+        build.build_trips(summary=True)
+        self.assertEqual(build.get_trip_ids().tolist(), df['TRIP_ID'].tolist())
+        self.assertEqual(build.get_dataframe().shape, df.shape)
+
+        summary = build.get_trip_summary()
+        self.assertEqual(summary.shape[0], df['TRIP_ID'].nunique())
+        first_trip = summary.loc[1]
+        self.assertEqual(first_trip['ENTRY_PLAZA'], 'NB01')
+        self.assertEqual(first_trip['TRANSACTIONS'], (df['TRIP_ID'] == 1).sum())
+        self.assertEqual(first_trip['SEGMENTS'], first_trip['TRANSACTIONS'] - 1)
+        self.assertEqual(first_trip['PLATE'], 'BCJ1314')
+
+        full_build = tb.TripBuilder(df, exit_nodes=exit_nodes)
+        full_build.build_trips()
+        pd.testing.assert_frame_equal(full_build.get_trip_summary(), summary)
+
+    def test_build_all_trips_unsorted_input(self):
+        df = self.get_test_dataframe()
+        exit_nodes = ['NB10', 'NB05', 'SB06', 'SB10', 'SB11']
+        df_shuffled = df.sample(frac=1, random_state=1)
+        build = tb.TripBuilder(df_shuffled, exit_nodes=exit_nodes)
+        build.build_trips()
+        df_output = build.get_dataframe()
+        self.assertEqual(df_output['TRANSACTION_ID'].tolist(), df_shuffled['TRANSACTION_ID'].tolist())
+
+        # same grouping of transactions, trip numbering follows the input order
+        expected = df_shuffled.groupby('TRIP_ID')['TRANSACTION_ID'].apply(frozenset)
+        result = df_output.groupby('TRIP_ID_BUILD')['TRANSACTION_ID'].apply(frozenset)
+        self.assertEqual(set(expected), set(result))
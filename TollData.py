@@ -7,22 +7,40 @@ import datetime
 import random
 import os
 import json
+import hashlib
+import contextlib
+import collections
+import time
+import io
+import asyncio
+import statistics
+import functools
+import itertools
+import heapq
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
 
 
 class PlateCombinatorics:
     """
     Class to handle plate combinatorics. Methods to return variations of plate values
-    based on common OCR errors.
+    based on common OCR errors. Variations are cached per plate, so repeated plates
+    are not expanded again.
     """
     _plate: str = ''
-    _result_list: list = []
+    _max_substitutions: int = None
     _ocr_dict: dict = {'O': 'Q', 'Q': 'O', '8': 'B', 'B': '8', '1': 'I',
                        'I': '1', 'A': '4', '4': 'A', 'D': 'O', 'G': '6',
                        '6': 'G', 'S': '5', '5': 'S'}
 
-    def __init__(self, plate=''):
+    def __init__(self, plate='', max_substitutions: int = None):
+        """
+        :param plate: plate value
+        :param max_substitutions: maximum number of characters substituted in a
+        variation. Default None, no limit
+        """
         self._plate = plate
-        self._result_list = []
+        self._max_substitutions = max_substitutions
 
     def set_plate(self, plate: str):
         """
@@ -39,47 +57,680 @@ class PlateCombinatorics:
         """
         return self._plate
 
-    def get_plate_combinations(self) -> list:
+    def get_plate_combinations(self, known_plates: 'PlateTrie' = None) -> list:
         """
-        :return: return list of plate combinations
+        :param known_plates: PlateTrie. Default None. If set, only combinations that
+        are known plates are returned, found by walking the trie
+        :return: return list of plate combinations, starting with the plate itself
         """
         if self._plate == '' or self._plate is None:
             raise ValueError('plate value blank')
-        self._result_list.append(self._plate)
-        return self.__plate_combinations(self._plate, 0, self._result_list)
+        if known_plates is not None:
+            return known_plates.search_combinations(self._plate, self._max_substitutions)
+        return list(self.plate_combinations(self._plate, self._max_substitutions))
+
+    @classmethod
+    def plate_combinations(cls, plate: str, max_substitutions: int = None) -> tuple:
+        """
+        Find all variations of a plate, substituting any subset of the characters
+        found in the OCR dictionary. Results are cached with LRU eviction.
+        :param plate: str of plate
+        :param max_substitutions: maximum number of characters substituted.
+        Default None, no limit
+        :return: tuple of unique plate variations, fewest substitutions first
+        """
+        return cls._cached_combinations(plate, max_substitutions)
+
+    @classmethod
+    def expand_series(cls, plates: pd.Series, max_substitutions: int = None) -> pd.DataFrame:
+        """
+        Expand the plate variations of every row. Variations are found once per
+        unique plate and broadcast back to the rows, so OCR aware matching over a
+        large dataframe becomes a single merge on VARIANT.
+        :param plates: Pandas Series of plates. Blank and missing plates are skipped
+        :param max_substitutions: maximum number of characters substituted.
+        Default None, no limit
+        :return: Pandas DataFrame of ROW, the row position, and VARIANT, in row order
+        """
+        codes, uniques = pd.factorize(plates.astype(object))
+        variants = [cls.plate_combinations(i, max_substitutions) if isinstance(i, str) and i != ''
+                    else () for i in uniques]
+        return _broadcast_variants(codes, variants)
+
+    @classmethod
+    @functools.lru_cache(maxsize=2 ** 16)
+    def _cached_combinations(cls, plate: str, max_substitutions: int) -> tuple:
+        positions = [c for c, i in enumerate(plate) if i in cls._ocr_dict]
+        if max_substitutions is None or max_substitutions > len(positions):
+            max_substitutions = len(positions)
+        result = []
+        for n in range(max_substitutions + 1):
+            for subset in itertools.combinations(positions, n):
+                chars = list(plate)
+                for index in subset:
+                    chars[index] = cls._ocr_dict[chars[index]]
+                result.append(''.join(chars))
+        return tuple(result)
+
+
+class PlateTrie:
+    """
+    Prefix trie of known plates, for example the plates of the AVI dictionary or
+    of the current dataset. Plate combinations are searched by walking the trie and
+    applying OCR substitutions only along branches that exist, so the search stops
+    as soon as no known plate shares the prefix, and its cost scales with the
+    number of matches instead of the number of combinations.
+    """
+    _ocr_dict: dict = PlateCombinatorics._ocr_dict
+    _root: dict = {}  # character {child}, None marks the end of a plate
+    _size: int = 0
+
+    def __init__(self, plates=None):
+        """
+        :param plates: iterable of known plates. Default None
+        """
+        self._root = {}
+        self._size = 0
+        if plates is not None:
+            self.add(plates)
+
+    def add(self, plates):
+        """
+        Add known plates. Blank and missing plates are skipped
+        :param plates: iterable of plates
+        """
+        for plate in plates:
+            if not isinstance(plate, str) or plate == '':
+                continue
+            node = self._root
+            for i in plate:
+                node = node.setdefault(i, {})
+            if None not in node:
+                node[None] = True
+                self._size += 1
+
+    def __contains__(self, plate) -> bool:
+        node = self._root
+        for i in plate:
+            node = node.get(i)
+            if node is None:
+                return False
+        return None in node
+
+    def search_combinations(self, plate: str, max_substitutions: int = None) -> list:
+        """
+        Find the plate combinations of PlateCombinatorics that are known plates
+        :param plate: str of plate
+        :param max_substitutions: maximum number of characters substituted.
+        Default None, no limit
+        :return: list of known plate combinations, the plate itself first if known
+        """
+        if max_substitutions is None:
+            max_substitutions = len(plate)
+        result = []
+        stack = [(self._root, 0, '', 0)]  # node, index, prefix, substitutions
+        while len(stack) > 0:
+            node, index, prefix, substitutions = stack.pop()
+            if index == len(plate):
+                if None in node:
+                    result.append(prefix)
+                continue
+            char = plate[index]
+            substitute = self._ocr_dict.get(char)
+            if substitute is not None and substitutions < max_substitutions and substitute in node:
+                stack.append((node[substitute], index + 1, prefix + substitute, substitutions + 1))
+            if char in node:
+                stack.append((node[char], index + 1, prefix + char, substitutions))
+        return result
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class OCRPlateIndex:
+    """
+    Index of known plates by a canonical key, with each character replaced by a
+    representative of its OCR confusion class. Every plate that is an OCR
+    combination of a read shares its canonical key, so the compatible known plates
+    are found with one hash lookup and a check of the few candidates, instead of
+    probing every combination. The check follows the one way substitutions of the
+    OCR dictionary, such as 'D' read as 'O'.
+    """
+    _ocr_dict: dict = PlateCombinatorics._ocr_dict
+    _canonical_table: dict = {}
+    _index: dict = {}  # canonical key [plates]
+    _plates: set = set([])
+
+    def __init__(self, plates=None):
+        """
+        :param plates: iterable of known plates. Default None
+        """
+        self._canonical_table = self.__create_canonical_table(self._ocr_dict)
+        self._index = {}
+        self._plates = set([])
+        if plates is not None:
+            self.add(plates)
 
     @staticmethod
-    def __update_name(old_name: str, new_char: str, index: int) -> str:
-        """
-        Update input string with new character value at specified index
-        :param old_name: str of original name
-        :param new_char: replacement character
-        :param index: index to replace character
-        :return: updated str
-        """
-        if index == 0:
-            return new_char + old_name[1:]
-        elif index == len(old_name) - 1:
-            return old_name[:index] + new_char
-        else:
-            new_name = old_name[:index] + new_char + old_name[index + 1:]
-            return new_name
+    def __create_canonical_table(ocr_dict: dict) -> dict:
+        """
+        Group the characters of the OCR dictionary into confusion classes
+        :return: str.translate table mapping each character to its class representative
+        """
+        classes = {}
+        for key, value in ocr_dict.items():
+            merged = classes.get(key, {key}) | classes.get(value, {value})
+            for i in merged:
+                classes[i] = merged
+        return str.maketrans({i: min(merged) for i, merged in classes.items()})
 
-    def __plate_combinations(self, plate: str, index: int, result_list: list):
+    def canonical_key(self, plate: str) -> str:
         """
-        Recursive method to find all permutations of a plate
         :param plate: str of plate
-        :param index: int of index
-        :param result_list: list of plate permutations
-        :return: list of plate permutations
+        :return: str, canonical key of the plate
+        """
+        return plate.translate(self._canonical_table)
+
+    def add(self, plates):
+        """
+        Add known plates. Blank and missing plates are skipped
+        :param plates: iterable of plates
+        """
+        for plate in plates:
+            if isinstance(plate, str) and plate != '' and plate not in self._plates:
+                self._plates.add(plate)
+                self._index.setdefault(self.canonical_key(plate), []).append(plate)
+
+    def is_compatible(self, read: str, plate: str) -> bool:
+        """
+        :param read: str of plate read
+        :param plate: str of known plate
+        :return: bool, whether plate is an OCR combination of the read
+        """
+        if len(read) != len(plate):
+            return False
+        for i, j in zip(read, plate):
+            if i != j and self._ocr_dict.get(i) != j:
+                return False
+        return True
+
+    def get_compatible(self, read) -> list:
+        """
+        :param read: str of plate read
+        :return: list of known plates that are OCR combinations of the read,
+        including the read itself if known
+        """
+        if not isinstance(read, str) or read == '':
+            return []
+        candidates = self.get_canonical_plates(self.canonical_key(read))
+        return [i for i in candidates if self.is_compatible(read, i)]
+
+    def get_canonical_plates(self, key: str) -> list:
+        """
+        :param key: str of canonical key
+        :return: list of known plates with the canonical key
+        """
+        return self._index.get(key, [])
+
+    def match_series(self, plates: pd.Series) -> pd.DataFrame:
+        """
+        Find the compatible known plates of every row, once per unique plate
+        :param plates: Pandas Series of plate reads
+        :return: Pandas DataFrame of ROW, the row position, and VARIANT, the
+        compatible known plate, in row order
+        """
+        codes, uniques = pd.factorize(plates.astype(object))
+        return _broadcast_variants(codes, [self.get_compatible(i) for i in uniques])
+
+    def __len__(self) -> int:
+        return len(self._plates)
+
+
+class FuzzyPlateIndex:
+    """
+    Edit distance index of known plates, for OCR errors that drop or insert
+    characters as well as swap them. Uses a symmetric deletion index over the
+    canonical keys of OCRPlateIndex: every key with up to max_distance characters
+    deleted is indexed, so a read only needs its own deletions looked up to find
+    the candidates. Candidates are ranked by a weighted edit distance, where a
+    substitution from the OCR dictionary costs less than other edits.
+    """
+    _ocr_dict: dict = PlateCombinatorics._ocr_dict
+    _max_distance: int = 1
+    _ocr_substitution_cost: float = 0.5
+    _plate_index: OCRPlateIndex = None
+    _deletions: dict = {}  # deleted key {canonical keys}
+
+    def __init__(self, plates=None, max_distance: int = 1, ocr_substitution_cost: float = 0.5):
+        """
+        :param plates: iterable of known plates. Default None
+        :param max_distance: int. Default 1. Maximum edit distance of candidates
+        :param ocr_substitution_cost: float. Default 0.5. Cost of a substitution
+        found in the OCR dictionary. Other substitutions, insertions and deletions cost 1
+        """
+        if max_distance < 0:
+            raise ValueError('Cannot use distance less than 0')
+        self._max_distance = max_distance
+        self._ocr_substitution_cost = ocr_substitution_cost
+        self._plate_index = OCRPlateIndex()
+        self._deletions = {}
+        if plates is not None:
+            self.add(plates)
+
+    def add(self, plates):
+        """
+        Add known plates. Blank and missing plates are skipped
+        :param plates: iterable of plates
+        """
+        for plate in plates:
+            if not isinstance(plate, str) or plate == '':
+                continue
+            key = self._plate_index.canonical_key(plate)
+            new_key = len(self._plate_index.get_canonical_plates(key)) == 0
+            self._plate_index.add([plate])
+            if new_key:
+                for i in self.__get_deletions(key, self._max_distance):
+                    self._deletions.setdefault(i, set()).add(key)
+
+    @staticmethod
+    def __get_deletions(key: str, max_distance: int) -> set:
+        """
+        :param key: str
+        :param max_distance: maximum number of deleted characters
+        :return: set of the key with up to max_distance characters deleted
+        """
+        result = {key}
+        current = {key}
+        for _ in range(max_distance):
+            current = {i[:j] + i[j + 1:] for i in current for j in range(len(i))}
+            result |= current
+        return result
+
+    def distance(self, read: str, plate: str) -> float:
+        """
+        Weighted edit distance between a read and a plate
+        :param read: str of plate read
+        :param plate: str of plate
+        :return: float distance
+        """
+        ocr_dict = self._ocr_dict
+        previous = [float(i) for i in range(len(plate) + 1)]
+        for c, i in enumerate(read, 1):
+            current = [float(c)]
+            for d, j in enumerate(plate, 1):
+                if i == j:
+                    cost = 0
+                elif ocr_dict.get(i) == j or ocr_dict.get(j) == i:
+                    cost = self._ocr_substitution_cost
+                else:
+                    cost = 1
+                current.append(min(previous[d] + 1, current[d - 1] + 1, previous[d - 1] + cost))
+            previous = current
+        return previous[-1]
+
+    def search(self, read, max_distance: float = None) -> list:
+        """
+        Find known plates within the edit distance of a read
+        :param read: str of plate read
+        :param max_distance: maximum weighted distance. Default None, uses the
+        distance of the index. Cannot exceed the distance of the index
+        :return: list of (plate, distance) tuples, closest first
+        """
+        if not isinstance(read, str) or read == '':
+            return []
+        if max_distance is None or max_distance > self._max_distance:
+            max_distance = self._max_distance
+        keys = set([])
+        for i in self.__get_deletions(self._plate_index.canonical_key(read), self._max_distance):
+            keys |= self._deletions.get(i, set())
+
+        result = []
+        for key in keys:
+            for plate in self._plate_index.get_canonical_plates(key):
+                if abs(len(plate) - len(read)) > max_distance:
+                    continue
+                distance = self.distance(read, plate)
+                if distance <= max_distance:
+                    result.append((plate, distance))
+        return sorted(result, key=lambda x: (x[1], x[0]))
+
+    def __len__(self) -> int:
+        return len(self._plate_index)
+
+
+class TransactionSchema:
+    """
+    Canonical compact schema for normalized transaction and trip dataframes.
+    Plates, plazas, lanes, and statuses are stored as categoricals, tags,
+    agencies, and transaction IDs as the smallest nullable integer type that
+    holds them, and DATETIME as datetime64. Integer fields that contain values
+    that are not whole numbers are left unchanged.
+    """
+    _category_fields: list = ['PLATE', 'Plaza', 'PLAZA', 'lane', 'Lane', 'CSC Lane',
+                              'Status', 'STATUS', 'Tag Status', 'Pmnt Type', 'Review Type']
+    _integer_fields: list = ['TAG_ID', 'AG', 'TRX_ID']
+    _datetime_fields: list = ['DATETIME']
+    _integer_types: list = ['Int8', 'Int16', 'Int32', 'Int64']
+
+    @classmethod
+    def apply(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert the fields of a dataframe to the compact schema
+        :param df: Pandas DataFrame
+        :return: Pandas DataFrame with compact field types
+        """
+        df = df.copy()
+        columns = df.columns
+        for field in cls._datetime_fields:
+            if field in columns and not pd.api.types.is_datetime64_any_dtype(df[field]):
+                df[field] = pd.to_datetime(df[field])
+        for field in cls._integer_fields:
+            if field in columns:
+                df[field] = cls.compact_integer(df[field])
+        for field in cls._category_fields:
+            if field in columns and not isinstance(df[field].dtype, pd.CategoricalDtype):
+                df[field] = df[field].astype('category')
+        return df
+
+    @classmethod
+    def compact_integer(cls, series: pd.Series, integer_types: list = None) -> pd.Series:
+        """
+        Convert series to the smallest nullable integer type that holds its values
+        :param series: Pandas Series
+        :param integer_types: list. Default None. Candidate nullable integer types,
+        smallest first. Defaults to Int8 through Int64
+        :return: Pandas Series, unchanged if values are not whole numbers
+        """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        values = pd.to_numeric(series, errors='coerce')
+        if values.isna().sum() != series.isna().sum():
+            return series
+        values = values.dropna()
+        if values.shape[0] > 0 and not (values % 1 == 0).all():
+            return series
+        low = values.min() if values.shape[0] > 0 else 0
+        high = values.max() if values.shape[0] > 0 else 0
+        for dtype in cls._integer_types if integer_types is None else integer_types:
+            info = np.iinfo(dtype.lower())
+            if info.min <= low and high <= info.max:
+                return pd.to_numeric(series, errors='coerce').astype(dtype)
+        return series
+
+
+class PlateTagRegistry:
+    """
+    Persistent interning dictionary that maps plate strings and tags to stable
+    int32 IDs across files and runs. Blank or missing plates and tags are
+    encoded as -1. IDs are assigned in order of first appearance and saved to a
+    pickle file.
+    """
+    _pickle_filename: str = 'plate_tag_registry.pkl'
+    _plate_ids: dict = {}  # plate ID
+    _tag_ids: dict = {}  # tag ID
+    _plates: list = []
+    _tags: list = []
+
+    def __init__(self, filename: str = None):
+        """
+        :param filename: pickle filename, loaded if it exists
+        """
+        if filename is not None:
+            self._pickle_filename = filename
+        self._plate_ids = {}
+        self._tag_ids = {}
+        self._plates = []
+        self._tags = []
+        if os.path.exists(self._pickle_filename):
+            self.__load_pickle()
+
+    def encode_plates(self, plates: pd.Series) -> np.ndarray:
+        """
+        :param plates: Pandas Series of plates
+        :return: int32 array of plate IDs, new plates are added
+        """
+        return self.__encode(plates, self._plate_ids, self._plates, self.__plate_key)
+
+    def encode_tags(self, tags: pd.Series) -> np.ndarray:
+        """
+        :param tags: Pandas Series of tags
+        :return: int32 array of tag IDs, new tags are added
+        """
+        return self.__encode(tags, self._tag_ids, self._tags, self.__tag_key)
+
+    def get_plate_id(self, plate: str) -> int:
+        """
+        :param plate: plate value
+        :return: int, plate ID or -1 if the plate is unknown
+        """
+        return self._plate_ids.get(self.__plate_key(plate), -1)
+
+    def get_tag_id(self, tag) -> int:
+        """
+        :param tag: tag value
+        :return: int, tag ID or -1 if the tag is unknown
+        """
+        return self._tag_ids.get(self.__tag_key(tag), -1)
+
+    def decode_plates(self, ids: np.ndarray) -> np.ndarray:
+        """
+        :param ids: array of plate IDs
+        :return: array of plates, None for -1
+        """
+        return self.__decode(ids, self._plates)
+
+    def decode_tags(self, ids: np.ndarray) -> np.ndarray:
+        """
+        :param ids: array of tag IDs
+        :return: array of tags, None for -1
         """
-        if index < len(plate):
-            if plate[index] in self._ocr_dict:
-                new_plate = self.__update_name(plate, self._ocr_dict[plate[index]], index)
-                self._result_list.append(new_plate)
-                self.__plate_combinations(new_plate, index + 1, result_list)
-            self.__plate_combinations(plate, index + 1, result_list)
-            return result_list
+        return self.__decode(ids, self._tags)
+
+    def add_keys(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add PLATE_KEY and TAG_KEY fields for the PLATE and TAG_ID fields
+        :param df: Pandas DataFrame
+        :return: Pandas DataFrame with key fields
+        """
+        if 'PLATE' in df.columns:
+            df['PLATE_KEY'] = self.encode_plates(df['PLATE'])
+        if 'TAG_ID' in df.columns:
+            df['TAG_KEY'] = self.encode_tags(df['TAG_ID'])
+        return df
+
+    def save(self):
+        """
+        Save registry to pickle file
+        """
+        with open(self._pickle_filename, 'wb') as f:
+            pickle.dump({'plates': self._plates, 'tags': self._tags}, f,
+                        pickle.HIGHEST_PROTOCOL)
+
+    def __load_pickle(self):
+        """
+        Read registry from pickle file
+        """
+        with open(self._pickle_filename, 'rb') as f:
+            data = pickle.load(f)
+        self._plates = data['plates']
+        self._tags = data['tags']
+        self._plate_ids = {plate: c for c, plate in enumerate(self._plates)}
+        self._tag_ids = {tag: c for c, tag in enumerate(self._tags)}
+
+    @staticmethod
+    def __plate_key(value):
+        """
+        :return: str plate value, None if blank or missing
+        """
+        if not isinstance(value, str) or value == '':
+            return None
+        return value
+
+    @staticmethod
+    def __tag_key(value):
+        """
+        :return: tag value, whole numbers as int so 1234 and 1234.0 match, None if
+        missing
+        """
+        if value is None or pd.isna(value):
+            return None
+        if isinstance(value, (float, np.floating)) and float(value).is_integer():
+            return int(value)
+        if isinstance(value, np.integer):
+            return int(value)
+        return value
+
+    @staticmethod
+    def __encode(values: pd.Series, ids: dict, keys: list, key_function) -> np.ndarray:
+        """
+        Factorize values and map each unique value to its ID
+        """
+        codes, uniques = pd.factorize(pd.Series(values).astype(object))
+        unique_ids = np.empty(len(uniques), dtype=np.int32)
+        for c, value in enumerate(uniques):
+            key = key_function(value)
+            if key is None:
+                unique_ids[c] = -1
+                continue
+            if key not in ids:
+                ids[key] = len(keys)
+                keys.append(key)
+            unique_ids[c] = ids[key]
+        out = np.full(len(codes), -1, dtype=np.int32)
+        valid = codes >= 0
+        out[valid] = unique_ids[codes[valid]]
+        return out
+
+    @staticmethod
+    def __decode(ids: np.ndarray, keys: list) -> np.ndarray:
+        """
+        Map IDs back to values
+        """
+        ids = np.asarray(ids)
+        lookup = np.array(keys + [None], dtype=object)
+        return lookup[np.where(ids < 0, len(keys), ids)]
+
+
+class TransactionDeduplicator:
+    """
+    Drops transactions whose TRX_ID was already seen, in this or an earlier run.
+    Seen IDs are kept as a sorted array of 64-bit hashes, so memory is
+    proportional to the number of distinct IDs, and can be saved to a .npy file.
+    New hashes are collected in a set and merged into the sorted array in
+    batches, so the array is not rebuilt for every chunk.
+    Transactions without an ID are kept. Duplicate counts are recorded per source.
+    """
+    _filename: str = None
+    _field: str = 'TRX_ID'
+    _seen: np.ndarray = None
+    _pending: set = set([])  # hashes not yet merged into _seen
+    _min_merge_size: int = 2 ** 16
+    _duplicate_counts: dict = {}  # source duplicates
+
+    def __init__(self, filename: str = None, field: str = None):
+        """
+        :param filename: .npy filename of the persistent index, loaded if it
+        exists. Default None keeps the index in memory only
+        :param field: transaction ID field. Default TRX_ID
+        """
+        self._filename = filename
+        if field is not None:
+            self._field = field
+        self._duplicate_counts = {}
+        self._seen = np.empty(0, dtype=np.uint64)
+        self._pending = set([])
+        if filename is not None and os.path.exists(filename):
+            self._seen = np.load(filename)
+
+    def filter(self, df: pd.DataFrame, source: str = None) -> pd.DataFrame:
+        """
+        Remove transactions already seen, and repeated IDs within the dataframe,
+        then add the remaining IDs to the index
+        :param df: Pandas DataFrame with the transaction ID field
+        :param source: name the duplicate count is recorded under
+        :return: Pandas DataFrame without duplicates
+        """
+        ids = df[self._field]
+        hashes = self.hash_ids(ids)
+        position = np.searchsorted(self._seen, hashes)
+        seen = self._seen[np.minimum(position, self._seen.shape[0] - 1)] == hashes \
+            if self._seen.shape[0] > 0 else np.zeros(hashes.shape[0], dtype=bool)
+        if len(self._pending) > 0:
+            seen |= np.fromiter((i in self._pending for i in hashes.tolist()), dtype=bool,
+                                count=hashes.shape[0])
+        has_id = ids.notna().to_numpy()
+        duplicate = has_id & seen
+        # hashes of missing IDs are not compared
+        duplicate[has_id] |= pd.Series(hashes[has_id]).duplicated().to_numpy()
+
+        self._pending.update(hashes[has_id & ~duplicate].tolist())
+        if len(self._pending) > max(self._seen.shape[0], self._min_merge_size):
+            self.__merge_pending()
+        n_duplicates = int(duplicate.sum())
+        self._duplicate_counts[source] = self._duplicate_counts.get(source, 0) + n_duplicates
+        if n_duplicates == 0:
+            return df
+        return df[~duplicate]
+
+    def get_duplicate_counts(self) -> dict:
+        """
+        :return: dict, source and number of duplicates dropped
+        """
+        return self._duplicate_counts
+
+    def get_id_count(self) -> int:
+        """
+        :return: int, number of distinct IDs seen
+        """
+        return self._seen.shape[0] + len(self._pending)
+
+    def __merge_pending(self):
+        """
+        Merge the pending hashes into the sorted array
+        """
+        pending = np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending))
+        self._seen = np.union1d(self._seen, pending)
+        self._pending = set([])
+
+    def get_filename(self) -> str:
+        """
+        :return: str, filename of the persistent index, None if in memory only
+        """
+        return self._filename
+
+    def save(self):
+        """
+        Save index to the .npy file
+        """
+        if self._filename is None:
+            raise ValueError('No index filename set')
+        self.__merge_pending()
+        with open(self._filename + '.tmp', 'wb') as f:
+            np.save(f, self._seen)
+        os.replace(self._filename + '.tmp', self._filename)
+
+    @staticmethod
+    def hash_ids(ids: pd.Series) -> np.ndarray:
+        """
+        Hash transaction IDs. Integer IDs are hashed as int64 without a float
+        conversion, so large IDs stay distinct. Float IDs that are whole numbers
+        within the exact float range hash the same as the integer IDs.
+        :param ids: Pandas Series of IDs
+        :return: uint64 array of hashes
+        """
+        if isinstance(ids.dtype, pd.CategoricalDtype):
+            ids = ids.astype(object)
+        if pd.api.types.is_integer_dtype(ids) and not \
+                (pd.api.types.is_unsigned_integer_dtype(ids) and ids.max() > np.iinfo(np.int64).max):
+            return pd.util.hash_array(ids.to_numpy(dtype=np.int64, na_value=0))
+        if pd.api.types.is_float_dtype(ids):
+            values = ids.to_numpy(dtype='float64', na_value=0)
+            exact = (values % 1 == 0) & (np.abs(values) <= 2 ** 53)
+            hashes = pd.util.hash_array(np.where(exact, values, 0).astype(np.int64))
+            if not exact.all():
+                hashes[~exact] = pd.util.hash_array(ids[~exact].astype(str).to_numpy(dtype=object))
+            return hashes
+        return pd.util.hash_array(ids.astype(str).to_numpy(dtype=object))
 
 
 class TransactionFile:
@@ -101,22 +752,101 @@ class TransactionFile:
     _excel_file_types: list = ['xlsx', 'xlsm']
     _payment_header_names: list = ['Pmnt Type']
     _trx_id_names: list = ['Trx ID']
-
-    def __init__(self, filename: str):
+    _chunksize: int = None
+    _usecols: list = None
+    _compact: bool = False
+    _registry: PlateTagRegistry = None
+    _buffer: bytes = None
+    _header: list = []
+    _column_dtypes: dict = {'Ocr Info': str, 'Plate Info': str, 'CSC Lane': str,
+                            'Pmnt Type': str}
+    _datetime_header_names: list = []
+    _csv_layouts: dict = {}  # (class, header row, header) parser arguments
+
+    def __init__(self, filename: str, chunksize: int = None, usecols: list = None,
+                 compact: bool = False, registry: PlateTagRegistry = None,
+                 buffer: bytes = None):
+        """
+        :param filename: filename of xlsx, xlsm, or csv file
+        :param chunksize: int. Default None. If set, the file is not read on
+        creation, and iter_chunks yields normalized chunks of this many rows
+        :param usecols: list. Default None. Columns to read from csv files, the
+        columns used for the normalized fields are always read
+        :param compact: bool. Default False. Convert the dataframe to the compact
+        TransactionSchema
+        :param registry: PlateTagRegistry. Default None. If set, PLATE_KEY and
+        TAG_KEY fields are added with the registry IDs
+        :param buffer: bytes. Default None. Raw file contents already read into
+        memory. The filename is then only used for the file type
+        """
         self._filename = filename
+        self._buffer = buffer
+        self._chunksize = chunksize
+        self._usecols = usecols
+        self._compact = compact
+        self._registry = registry
         print('Processing: ' + filename)
-        if filename.split('.')[1] in self._excel_file_types:
-            self.__process_excel_file()
-        elif filename.split('.')[1] == 'csv':
-            self.__process_csv_file()
+        if chunksize is not None and chunksize < 1:
+            raise ValueError(str(chunksize) + ' is Invalid. Value must be at least 1')
+        file_type = self.get_file_type(filename)
+        if file_type in self._excel_file_types:
+            if chunksize is None:
+                self.__process_excel_file()
+        elif file_type == 'csv':
+            if chunksize is None:
+                self.__process_csv_file()
             self._input_is_csv = True
         else:
             raise TypeError('Input input, must be xlsx or csv')
 
+        if chunksize is None:
+            self._normalize()
+
+    def _derive_fields(self):
+        """
+        Add the normalized TAG_ID, AG, PLATE, and TRX_ID fields to the dataframe
+        """
         self.__create_tag_fields()
         self.__create_plate_field()
         self.__create_trx_id_field()
 
+    def _normalize(self):
+        """
+        Add the normalized fields, convert to the compact schema and add registry
+        keys if set
+        """
+        self._derive_fields()
+        if self._compact:
+            self._df = TransactionSchema.apply(self._df)
+        elif self._chunksize is not None:
+            # chunks infer their own types, so an all empty chunk would be float64
+            for i in TransactionSchema._integer_fields:
+                if i in self._df.columns:
+                    self._df[i] = TransactionSchema.compact_integer(self._df[i], ['Int64'])
+        if self._registry is not None:
+            self._registry.add_keys(self._df)
+
+    def iter_chunks(self):
+        """
+        Read the file in chunks of chunksize rows. Each chunk is yielded as a
+        dataframe with the normalized fields already added, so files larger
+        than memory can be processed.
+        """
+        if self._chunksize is None:
+            raise ValueError('chunksize not set')
+        if self._input_is_csv:
+            self.__get_csv_header()
+            reader = pd.read_csv(self.__source(), chunksize=self._chunksize, low_memory=False,
+                                 **self.__csv_read_arguments())
+        else:
+            reader = self.__iter_excel_frames(self._chunksize)
+        with reader as chunks:
+            for chunk in chunks:
+                self._df = chunk
+                self._normalize()
+                yield self._df
+        self._df = None
+
     def __create_trx_id_field(self):
         complete: bool = False
         for i in self._trx_id_names:
@@ -145,9 +875,17 @@ class TransactionFile:
         """
         if self._input_is_csv:
             raise ValueError('Input file is a csv file')
-        out_filename = self._filename.split('.')[0] + '.csv'
+        out_filename = os.path.splitext(self._filename)[0] + '.csv'
         self._df.to_csv(out_filename)
 
+    @staticmethod
+    def get_file_type(filename: str) -> str:
+        """
+        :param filename: filename, may include directories
+        :return: str, lower case file extension without the dot
+        """
+        return os.path.splitext(filename)[1][1:].lower()
+
     def __select_worksheet(self, workbook: opxl):
         """
         Select worksheet from all worksheets. Uses sheet_names_list
@@ -158,33 +896,102 @@ class TransactionFile:
                 if i in sheet.title:
                     self._sheet_name = sheet.title
 
-    def __set_excel_header_row(self, wb: opxl):
+    @contextlib.contextmanager
+    def __iter_excel_frames(self, chunksize: int = None):
         """
-        Finds header row in workbook. Uses header_values for search.
-        :param wb: workbook
+        Context manager for a generator of dataframes from the selected worksheet.
+        The workbook is read once in read-only mode, the header row is found
+        while streaming, and the rows after it are collected into column
+        buffers. Blank rows at the end of the worksheet are dropped.
+        :param chunksize: rows per dataframe, None for a single dataframe
         """
-        ws: opxl = wb[self._sheet_name]
-        header_row: int = 0
-        found: bool = False
-        for row in ws:
-            if found:
-                break
-            for cell in row:
-                if cell.value in self._header_values:
-                    found = True
+        wb: opxl = opxl.load_workbook(filename=self.__source(), read_only=True)
+        try:
+            self.__select_worksheet(wb)
+            yield self.__stream_worksheet(wb[self._sheet_name], chunksize)
+        finally:
+            wb.close()
+
+    def __stream_worksheet(self, ws: opxl, chunksize: int = None):
+        """
+        Generator of dataframes from worksheet rows
+        :param ws: worksheet
+        :param chunksize: rows per dataframe, None for a single dataframe
+        """
+        header = None
+        buffers: list = []
+        n_rows = 0
+        n_blank = 0
+        yielded = False
+        for header_row, row in enumerate(ws.iter_rows(values_only=True)):
+            if header is None:
+                if any(value in self._header_values for value in row):
                     self._header_row = header_row
-                    break
-            header_row += 1
+                    header = self.__excel_column_names(row)
+                    buffers = [[] for i in header]
+                continue
+            if all(value is None for value in row):
+                n_blank += 1
+                continue
+            # blank rows before a value row are kept, and count towards chunksize
+            rows = [()] * n_blank + [row]
+            n_blank = 0
+            for values in rows:
+                for c, buffer in enumerate(buffers):
+                    buffer.append(values[c] if c < len(values) else None)
+                n_rows += 1
+                if chunksize is not None and n_rows >= chunksize:
+                    yield self.__frame_from_buffers(header, buffers)
+                    yielded = True
+                    buffers = [[] for i in header]
+                    n_rows = 0
+
+        if header is None:
+            raise ValueError('Header row not found in sheet: ' + str(self._sheet_name))
+        if n_rows > 0 or not yielded:
+            yield self.__frame_from_buffers(header, buffers)
+
+    @staticmethod
+    def __excel_column_names(row: tuple) -> list:
+        """
+        Column names from the header row, named the same way as pd.read_excel
+        :param row: header row values
+        :return: list of column names
+        """
+        names = []
+        for c, value in enumerate(row):
+            name = 'Unnamed: ' + str(c) if value is None else value
+            if name in names:
+                count = 1
+                while str(name) + '.' + str(count) in names:
+                    count += 1
+                name = str(name) + '.' + str(count)
+            names.append(name)
+        return names
+
+    def __frame_from_buffers(self, header: list, buffers: list) -> pd.DataFrame:
+        """
+        Create dataframe from column buffers, using column_dtypes where known
+        :param header: list of column names
+        :param buffers: list of column value lists
+        :return: Pandas DataFrame
+        """
+        columns = {}
+        for name, buffer in zip(header, buffers):
+            if name in self._column_dtypes:
+                series = pd.Series(buffer, dtype=object)
+                columns[name] = series.where(series.isna(),
+                                             series.astype(self._column_dtypes[name]))
+            else:
+                columns[name] = pd.Series(buffer)
+        return pd.DataFrame(columns)
 
     def __process_excel_file(self):
         """
         Process excel data file info dataframe
         """
-        wb: opxl = opxl.load_workbook(filename=self._filename, read_only=True)
-        self.__select_worksheet(wb)
-        self.__set_excel_header_row(wb)
-        self._df = pd.read_excel(self._filename, sheet_name=self._sheet_name,
-                                 skiprows=self._header_row)
+        with self.__iter_excel_frames() as frames:
+            self._df = next(frames)
 
     def __create_tag_fields(self):
         columns = self._df.columns
@@ -203,18 +1010,46 @@ class TransactionFile:
         return self._df
 
     def __get_csv_header(self):
-        with open(self._filename) as csvfile:
-            reader = csv.reader(csvfile)
-            header_row: int = 0
-            row_found: bool = False
-
-            for row in reader:
-                if row_found:
-                    break
-                for value in row:
-                    if value in self._header_values:
-                        self._header_row = header_row
-                header_row += 1
+        """
+        Find the header row of the file. Uses header_values for search. Rows are
+        read one at a time, and reading stops at the header row.
+        :raises ValueError: if no header row is found
+        """
+        if self._buffer is None:
+            csvfile = open(self._filename, newline='')
+        else:
+            csvfile = io.TextIOWrapper(io.BytesIO(self._buffer), newline='')
+        with csvfile:
+            for header_row, row in enumerate(csv.reader(csvfile)):
+                if any(value in self._header_values for value in row):
+                    self._header_row = header_row
+                    self._header = row
+                    return
+        raise ValueError('Header row not found in file: ' + str(self._filename))
+
+    def __csv_read_arguments(self) -> dict:
+        """
+        Parser arguments for the detected csv layout. Columns with a known type
+        are given an explicit dtype or parsed as dates, so pandas does not infer
+        them. Layouts are cached per export format.
+        :return: dict of pd.read_csv keyword arguments
+        """
+        usecols = None if self._usecols is None else tuple(self._usecols)
+        key = (type(self).__name__, self._header_row, tuple(self._header), usecols)
+        if key not in self._csv_layouts:
+            columns = self._header
+            if usecols is not None:
+                required = self._ocr_header_names + self._tag_header_names + \
+                    self._agency_header_names + self._trx_id_names
+                columns = [i for i in self._header if i in usecols or i in required]
+            layout = {'skiprows': self._header_row,
+                      'dtype': {i: self._column_dtypes[i] for i in columns
+                                if i in self._column_dtypes},
+                      'parse_dates': [i for i in columns if i in self._datetime_header_names]}
+            if usecols is not None:
+                layout['usecols'] = columns
+            self._csv_layouts[key] = layout
+        return self._csv_layouts[key]
 
     def __process_csv_file(self):
         """
@@ -222,16 +1057,32 @@ class TransactionFile:
         pandas dataframe.
         """
         self.__get_csv_header()
-        self._df = pd.read_csv(self._filename, skiprows=self._header_row, low_memory=False)
+        self._df = pd.read_csv(self.__source(), low_memory=False, **self.__csv_read_arguments())
+
+    def __source(self):
+        """
+        :return: filename, or a file object of the buffer if set
+        """
+        if self._buffer is None:
+            return self._filename
+        return io.BytesIO(self._buffer)
 
 
 class TripFile(TransactionFile):
     _header_values = ['id', 'dt', 'lane', 'agency', 'Plaza']
     _ocr_header_names = ['plate', 'Review Type', 'Plate Info']
     _tag_header_names = ['Ag-Tag', 'Prime']
+    _column_dtypes = {'plate': str, 'Review Type': str, 'Plate Info': str,
+                      'Ag-Tag': str, 'Prime': str, 'lane': str, 'Plaza': str}
+    _datetime_header_names = ['Entry Time']
+
+    def __init__(self, filename, chunksize: int = None, usecols: list = None,
+                 compact: bool = False, registry: PlateTagRegistry = None,
+                 buffer: bytes = None):
+        super(TripFile, self).__init__(filename, chunksize, usecols, compact, registry, buffer)
 
-    def __init__(self, filename):
-        super(TripFile, self).__init__(filename)
+    def _derive_fields(self):
+        super(TripFile, self)._derive_fields()
         self.__create_tag_fields()
 
     def __create_tag_fields(self):
@@ -242,11 +1093,230 @@ class TripFile(TransactionFile):
         columns = self._df.columns
         for i in self._tag_header_names:
             if i in columns:
-                tag_field: pd.Series = self._df[i].str.split(pat='-', expand=True)
+                tag_field: pd.DataFrame = self._df[i].astype(object).str.split(
+                    pat='-', expand=True).reindex(columns=[0, 1])
                 self._df['AG'] = pd.to_numeric(tag_field[0])
                 self._df['TAG_ID'] = pd.to_numeric(tag_field[1])
 
 
+class ParallelFileReader:
+    """
+    Class to parse many transaction or trip files in a process pool. The number
+    of files submitted to the pool at once is bounded, and a file that fails to
+    parse is recorded as an error without stopping the other files.
+    """
+    _filenames: list = []
+    _file_class: type = None
+    _processes: int = None
+    _max_in_flight: int = None
+    _show_progress: bool = True
+    _compact: bool = False
+    _registry: PlateTagRegistry = None
+    _errors: dict = {}  # filename error message
+
+    def __init__(self, filenames: list, file_class: type = None, processes: int = None,
+                 max_in_flight: int = None, show_progress: bool = True,
+                 compact: bool = False, registry: PlateTagRegistry = None):
+        """
+        :param filenames: list of filenames
+        :param file_class: class used to parse files. Default TransactionFile
+        :param processes: number of worker processes. None uses all cores, 1 parses
+        the files in the current process
+        :param max_in_flight: maximum number of files submitted to the pool at
+        once. Default is twice the number of worker processes
+        :param show_progress: bool. Default True. Show a progress bar
+        :param compact: bool. Default False. Convert dataframes to the compact
+        TransactionSchema
+        :param registry: PlateTagRegistry. Default None. If set, PLATE_KEY and
+        TAG_KEY fields are added in this process, so IDs are shared by all files
+        """
+        self._filenames = list(filenames)
+        self._compact = compact
+        self._registry = registry
+        self._file_class = TransactionFile if file_class is None else file_class
+        self._processes = os.cpu_count() if processes is None else processes
+        if self._processes < 1:
+            raise ValueError(str(processes) + ' is Invalid. Value must be at least 1')
+        self._max_in_flight = 2 * self._processes if max_in_flight is None else max_in_flight
+        if self._max_in_flight < 1:
+            raise ValueError(str(max_in_flight) + ' is Invalid. Value must be at least 1')
+        self._show_progress = show_progress
+        self._errors = {}
+
+    def get_errors(self) -> dict:
+        """
+        :return: dict, filename and error message of files that failed to parse
+        """
+        return self._errors
+
+    def iter_dataframes(self):
+        """
+        Parse files and yield (filename, dataframe) in order of completion
+        """
+        self._errors = {}
+        progress = tqdm(total=len(self._filenames), disable=not self._show_progress)
+        try:
+            if self._processes == 1:
+                for filename in self._filenames:
+                    try:
+                        df = _read_file_worker(self._file_class, filename, self._compact)
+                    except Exception as e:
+                        self._errors[filename] = repr(e)
+                    else:
+                        yield filename, self.__add_registry_keys(df)
+                    progress.update(1)
+                return
+
+            with ProcessPoolExecutor(max_workers=self._processes) as executor:
+                pending = {}
+                remaining = iter(self._filenames)
+                while True:
+                    for filename in remaining:
+                        future = executor.submit(_read_file_worker, self._file_class, filename,
+                                                 self._compact)
+                        pending[future] = filename
+                        if len(pending) >= self._max_in_flight:
+                            break
+                    if len(pending) == 0:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        filename = pending.pop(future)
+                        try:
+                            df = future.result()
+                        except Exception as e:
+                            self._errors[filename] = repr(e)
+                        else:
+                            yield filename, self.__add_registry_keys(df)
+                        progress.update(1)
+        finally:
+            progress.close()
+
+    def __add_registry_keys(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add registry keys to a parsed dataframe, if a registry is set
+        """
+        if self._registry is not None:
+            self._registry.add_keys(df)
+        return df
+
+    def read(self, deduplicator: TransactionDeduplicator = None) -> pd.DataFrame:
+        """
+        Parse all files and concatenate the results once, in filename order
+        :param deduplicator: TransactionDeduplicator. Default None. If set,
+        transactions already seen are dropped from each file, in filename order
+        :return: Pandas DataFrame
+        """
+        results = dict(self.iter_dataframes())
+        frames = [results[i] for i in self._filenames if i in results]
+        if deduplicator is not None:
+            frames = [deduplicator.filter(results[i], source=i)
+                      for i in self._filenames if i in results]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        df = pd.concat(frames)
+        if self._compact:
+            # categories differ between files
+            df = TransactionSchema.apply(df)
+        return df
+
+
+class AsyncFileReader:
+    """
+    Asyncio ingestion pipeline. The raw bytes of upcoming files are read in a
+    thread while earlier files are parsed in a process pool, with a bounded queue
+    between the two stages, so disk reads and parsing overlap. A file that fails
+    to read or parse is recorded as an error without stopping the other files.
+    """
+    _filenames: list = []
+    _file_class: type = None
+    _processes: int = None
+    _queue_size: int = 4
+    _compact: bool = False
+    _errors: dict = {}  # filename error message
+
+    def __init__(self, filenames: list, file_class: type = None, processes: int = None,
+                 queue_size: int = 4, compact: bool = False):
+        """
+        :param filenames: list of filenames
+        :param file_class: class used to parse files. Default TransactionFile
+        :param processes: number of worker processes. None uses all cores
+        :param queue_size: maximum number of files read ahead of parsing
+        :param compact: bool. Default False. Convert dataframes to the compact
+        TransactionSchema
+        """
+        self._filenames = list(filenames)
+        self._file_class = TransactionFile if file_class is None else file_class
+        self._processes = os.cpu_count() if processes is None else processes
+        if self._processes < 1:
+            raise ValueError(str(processes) + ' is Invalid. Value must be at least 1')
+        if queue_size < 1:
+            raise ValueError(str(queue_size) + ' is Invalid. Value must be at least 1')
+        self._queue_size = queue_size
+        self._compact = compact
+        self._errors = {}
+
+    def get_errors(self) -> dict:
+        """
+        :return: dict, filename and error message of files that failed
+        """
+        return self._errors
+
+    def read(self) -> pd.DataFrame:
+        """
+        Run the pipeline and concatenate the results once, in filename order
+        :return: Pandas DataFrame
+        """
+        return asyncio.run(self.read_async())
+
+    async def read_async(self) -> pd.DataFrame:
+        """
+        Coroutine version of read, for use in a running event loop
+        :return: Pandas DataFrame
+        """
+        self._errors = {}
+        results = {}
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self._queue_size)
+
+        async def read_files():
+            for filename in self._filenames:
+                try:
+                    data = await loop.run_in_executor(None, _read_bytes_worker, filename)
+                except OSError as e:
+                    self._errors[filename] = repr(e)
+                    continue
+                await queue.put((filename, data))
+            for i in range(self._processes):
+                await queue.put(None)
+
+        async def parse_files(executor: ProcessPoolExecutor):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                filename, data = item
+                try:
+                    results[filename] = await loop.run_in_executor(
+                        executor, _read_buffer_worker, self._file_class, filename, data,
+                        self._compact)
+                except Exception as e:
+                    self._errors[filename] = repr(e)
+
+        with ProcessPoolExecutor(max_workers=self._processes) as executor:
+            await asyncio.gather(read_files(),
+                                 *[parse_files(executor) for i in range(self._processes)])
+
+        frames = [results[i] for i in self._filenames if i in results]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        df = pd.concat(frames)
+        if self._compact:
+            # categories differ between files
+            df = TransactionSchema.apply(df)
+        return df
+
+
 class AVIValidation:
     """
     Class to test whether plate is read without a tag. The read threshold
@@ -267,6 +1337,7 @@ class AVIValidation:
     _static_dict: bool = False
     _read_threshold: int = 0
     _exact_plates: bool = True
+    _plate_index: bool = False
     _error_indices: set = set([])
     _export_dict: bool = True
 
@@ -312,8 +1383,22 @@ class AVIValidation:
         by threshold value and whether to use a static or dynamic dictionary.
         """
         plates = self._df['PLATE'].tolist()
-        tags = self._df['TAG_ID'].tolist()
+        tags = self._df['TAG_ID'].to_numpy(dtype='float64', na_value=np.nan).tolist()
         error_index = set([])
+        plate_index = None
+        known_plates = None
+        if not self._exact_plates and self._plate_index:
+            plate_index = OCRPlateIndex(self._plate_tag_dict.keys())
+        elif not self._exact_plates and self._static_dict:
+            # combinations not in a static dictionary are skipped, so only the
+            # combinations that are dictionary plates are searched
+            known_plates = PlateTrie(self._plate_tag_dict.keys())
+            known_combinations = {}
+        elif not self._exact_plates:
+            expanded = PlateCombinatorics.expand_series(self._df['PLATE'])
+            variants = expanded['VARIANT'].tolist()
+            variant_bounds = np.searchsorted(expanded['ROW'].to_numpy(),
+                                             np.arange(len(plates) + 1)).tolist()
 
         for c, i in enumerate(plates):
             # if plate value blank continue
@@ -321,9 +1406,18 @@ class AVIValidation:
                 continue
 
             plate_combinations = []
-            if not self._exact_plates:
-                combos = PlateCombinatorics(i)
-                plate_combinations = combos.get_plate_combinations()
+            if plate_index is not None:
+                # only plates already in the dictionary are matched, the read is added
+                plate_combinations = plate_index.get_compatible(i)
+                if isinstance(i, str) and i not in self._plate_tag_dict and not self._static_dict:
+                    self._plate_tag_dict[i] = [tags[c], 0]
+                    plate_index.add([i])
+            elif known_plates is not None:
+                if isinstance(i, str) and i not in known_combinations:
+                    known_combinations[i] = known_plates.search_combinations(i)
+                plate_combinations = known_combinations.get(i, [])
+            elif not self._exact_plates:
+                plate_combinations = variants[variant_bounds[c]:variant_bounds[c + 1]]
             else:
                 plate_combinations.append(i)
 
@@ -333,7 +1427,7 @@ class AVIValidation:
                 if j not in self._plate_tag_dict:
                     if self._static_dict:
                         continue
-                    self._plate_tag_dict[j] = [float(tags[c]), 0]
+                    self._plate_tag_dict[j] = [tags[c], 0]
                 # plate and tag match
                 elif self._plate_tag_dict[j][0] == tags[c]:
                     self._plate_tag_dict[j][1] += 1
@@ -467,7 +1561,7 @@ class AVIValidation:
 
     def __init__(self, plate_tag_dict_name=None, dataframe: pd.DataFrame = None,
                  static_dict: bool = False, read_threshold: int = 5,
-                 exact_plates: bool = True, export_dict: bool = True):
+                 exact_plates: bool = True, export_dict: bool = True, plate_index: bool = False):
         """
         :param plate_tag_dict_name: file or filename for plate/tag dictionary. Can use a
         pickle, csv, or Python dict
@@ -481,6 +1575,9 @@ class AVIValidation:
         combinatorics based on common OCR character errors.
         :param export_dict: bool. Default True. Export dictionary to pkl
         file
+        :param plate_index: bool. Default False. With exact_plates False, match
+        reads to the OCR compatible plates already in the dictionary using an
+        OCRPlateIndex, instead of adding every combination to the dictionary.
         """
         self.__set_or_create_plate_tag_dict(plate_tag_dict_name)
         self._plate_tag_filename = plate_tag_dict_name
@@ -488,6 +1585,7 @@ class AVIValidation:
         self._read_threshold = read_threshold
         self._exact_plates = exact_plates
         self._export_dict = export_dict
+        self._plate_index = plate_index
         self.__validate_dataframe(dataframe)
 
 
@@ -676,27 +1774,600 @@ class AssignRate:
         print("inheritance test print")
 
 
+class PlateTagWindow:
+    """
+    Plate/tag read counts for a training window and the test window that follows
+    it. Days of reads are added and removed as the windows slide, and the AVI
+    error count of the test window is only recomputed for the plates that change.
+
+    Plates are matched the same way as AVIValidation. The dictionary tag for a
+    plate is the tag of its first read in the training window, and its reads are
+    the later training reads with that tag. Test reads of the plate with any
+    other tag, or without a tag, are errors once the dictionary reads reach
+    read_threshold. Test reads of the dictionary tag are not added to the reads.
+    As in AVITest, the dictionary can be limited to the n_plates plates with the
+    most reads, ties going to the plate read first.
+    """
+    _read_threshold: int = 5
+    _n_plates: int = 0
+    _training: dict = {}  # plate {tag: reads}
+    _first_tags: dict = {}  # plate {day: (order in day, tag of the first read)}
+    _testing: dict = {}  # plate {tag: reads}
+    _errors: dict = {}  # plate errors
+    _error_count: int = 0
+    _transaction_count: int = 0
+
+    def __init__(self, read_threshold: int = 5, n_plates: int = 0):
+        """
+        :param read_threshold: Default 5. Plate/tag reads required before an
+        error is recorded.
+        :param n_plates: Default 0. Number of plates in the dictionary. 0 uses
+        an unlimited size dictionary
+        """
+        self._read_threshold = read_threshold
+        self._n_plates = n_plates
+        self._training = {}
+        self._first_tags = {}
+        self._testing = {}
+        self._errors = {}
+        self._error_count = 0
+        self._transaction_count = 0
+
+    def update_training(self, counts: list, day, sign: int = 1):
+        """
+        Add (sign=1) or remove (sign=-1) a day of reads from the training window
+        :param counts: list of (plate, tag, reads), tag is None if not read. The
+        first entry of a plate is the tag of its first read of the day
+        :param day: day of the reads, days must be added in order
+        :param sign: int, 1 or -1
+        """
+        for c, (plate, tag, reads) in enumerate(counts):
+            first_tags = self._first_tags.setdefault(plate, {})
+            if sign > 0:
+                first_tags.setdefault(day, (c, tag))
+            else:
+                first_tags.pop(day, None)
+            if not first_tags:
+                del self._first_tags[plate]
+            self.__update_counts(self._training, plate, tag, sign * reads)
+            self.__refresh_plate(plate)
+
+    def update_testing(self, counts: list, n_transactions: int, sign: int = 1):
+        """
+        Add (sign=1) or remove (sign=-1) reads from the test window
+        :param counts: list of (plate, tag, reads), tag is None if not read
+        :param n_transactions: int, all transactions of the day, including those
+        without a plate
+        :param sign: int, 1 or -1
+        """
+        self._transaction_count += sign * n_transactions
+        for plate, tag, reads in counts:
+            self.__update_counts(self._testing, plate, tag, sign * reads)
+            self.__refresh_plate(plate)
+
+    def get_accuracy(self) -> float:
+        """
+        :return: float, share of test window transactions without an AVI error
+        """
+        if self._transaction_count == 0:
+            return np.nan
+        error_count = self._error_count
+        if self._n_plates != 0 and len(self._first_tags) > self._n_plates:
+            plates = set(heapq.nsmallest(self._n_plates, self._first_tags, key=self.__dictionary_rank))
+            error_count = sum(errors for plate, errors in self._errors.items() if plate in plates)
+        return 1 - error_count / self._transaction_count
+
+    def __dictionary_tag(self, plate: str) -> tuple:
+        """
+        :param plate: plate in the training window
+        :return: tuple of the first day, the order of the first read in that
+        day, and the dictionary tag
+        """
+        first_tags = self._first_tags[plate]
+        day = min(first_tags)
+        return (day,) + first_tags[day]
+
+    def __dictionary_reads(self, plate: str, tag) -> int:
+        """
+        :param plate: plate in the training window
+        :param tag: dictionary tag of the plate
+        :return: int, training reads of the dictionary tag after the first read
+        """
+        # a read without a tag never matches, as in AVIValidation
+        return 0 if tag is None else self._training[plate][tag] - 1
+
+    def __dictionary_rank(self, plate: str) -> tuple:
+        """
+        :param plate: plate in the training window
+        :return: tuple, sorts plates by most reads, then by first read
+        """
+        day, order, tag = self.__dictionary_tag(plate)
+        return -self.__dictionary_reads(plate, tag), day, order
+
+    @staticmethod
+    def __update_counts(counts: dict, plate: str, tag, reads: int):
+        """
+        Update nested plate/tag counts, removing entries that reach zero
+        """
+        tags = counts.setdefault(plate, {})
+        value = tags.get(tag, 0) + reads
+        if value > 0:
+            tags[tag] = value
+        else:
+            tags.pop(tag, None)
+            if not tags:
+                del counts[plate]
+
+    def __refresh_plate(self, plate: str):
+        """
+        Recompute the test window errors of one plate
+        """
+        errors = 0
+        first_tags = self._first_tags.get(plate)
+        testing_tags = self._testing.get(plate)
+        if first_tags and testing_tags:
+            tag = self.__dictionary_tag(plate)[2]
+            if self.__dictionary_reads(plate, tag) >= self._read_threshold:
+                errors = sum(testing_tags.values()) - (0 if tag is None else testing_tags.get(tag, 0))
+        self._error_count += errors - self._errors.pop(plate, 0)
+        if errors:
+            self._errors[plate] = errors
+
+
+class TripDataCache:
+    """
+    Columnar on-disk cache of parsed trip files. Each source file is stored as
+    Parquet files partitioned by date, and a manifest records the size and
+    modification time of every source file. Only new or changed files are parsed
+    when the cache is updated, and reading a date window only opens the
+    partitions for those dates. Source files are recorded by absolute path, so
+    the cache can be updated from any working directory. Parquet support
+    requires pyarrow.
+    """
+    _directory: str = 'trip_data_cache'
+    _manifest_filename: str = 'manifest.json'
+    _manifest: dict = {}  # absolute source filename {size, mtime, partitions}
+    _file_class: type = None
+    _datetime_field: str = 'DATETIME'
+    _datetime_source_field: str = 'Entry Time'
+    _undated_partition: str = 'undated'
+    _errors: dict = {}
+    _compact: bool = True
+
+    def __init__(self, directory: str = None, file_class: type = None, compact: bool = True):
+        """
+        :param directory: cache directory, created if it does not exist
+        :param file_class: class used to parse source files. Default TripFile
+        :param compact: bool. Default True. Store and read data in the compact
+        TransactionSchema
+        """
+        if directory is not None:
+            self._directory = directory
+        self._directory = os.path.abspath(self._directory)
+        self._file_class = TripFile if file_class is None else file_class
+        self._compact = compact
+        self._errors = {}
+        os.makedirs(self._directory, exist_ok=True)
+        self.__load_manifest()
+
+    def get_manifest(self) -> dict:
+        """
+        :return: dict, cached source files by absolute path
+        """
+        return self._manifest
+
+    def update(self, filenames: list, processes: int = None) -> list:
+        """
+        Parse new or changed source files in a process pool and write them to
+        the cache. Files that fail to parse are not cached, see get_errors. The
+        cached data of source files that no longer exist is removed.
+        :param filenames: list of source filenames
+        :param processes: number of worker processes. None uses all cores
+        :return: list of filenames that were parsed
+        """
+        self.prune()
+        changed = [i for i in filenames if self.is_changed(i)]
+        collections.deque(self.iter_update(changed, processes), maxlen=0)
+        return [i for i in changed if i not in self._errors]
+
+    def prune(self) -> list:
+        """
+        Remove the cached data of source files that no longer exist
+        :return: list of filenames removed from the cache
+        """
+        removed = [i for i in self._manifest if not os.path.exists(i)]
+        for filename in removed:
+            self.__remove_partitions(filename)
+        if len(removed) > 0:
+            self.__save_manifest()
+        return removed
+
+    def iter_update(self, filenames: list, processes: int = None,
+                    deduplicator: TransactionDeduplicator = None):
+        """
+        Parse source files in a process pool, write each to the cache, and yield
+        (filename, dataframe) in order of completion. Files that fail to parse
+        are not cached, see get_errors.
+        :param filenames: list of source filenames
+        :param processes: number of worker processes. None uses all cores
+        :param deduplicator: TransactionDeduplicator. Default None. If set,
+        transactions already seen are dropped before each file is written, so
+        the cache and the yielded dataframes do not contain them. Transactions
+        cached for a previous version of the same file are kept.
+        """
+        reader = ParallelFileReader(filenames, file_class=self._file_class, processes=processes,
+                                    show_progress=False, compact=self._compact)
+        for filename, df in reader.iter_dataframes():
+            if deduplicator is not None:
+                df = self.__deduplicate(filename, df, deduplicator)
+            self.add_dataframe(filename, df)
+            yield filename, df
+        self._errors = reader.get_errors()
+
+    def __deduplicate(self, filename: str, df: pd.DataFrame,
+                      deduplicator: TransactionDeduplicator) -> pd.DataFrame:
+        """
+        Drop transactions already seen, except those cached for a previous
+        version of the file, which the deduplicator has already seen from it
+        :param filename: source filename
+        :param df: parsed dataframe
+        :param deduplicator: TransactionDeduplicator
+        :return: Pandas DataFrame
+        """
+        key = self.__manifest_key(filename)
+        cached = pd.Series(dtype='float64')
+        if key in self._manifest:
+            cached = self.__read_source(key, ['TRX_ID'])['TRX_ID']
+        kept = df['TRX_ID'].isin(cached).to_numpy() & df['TRX_ID'].notna().to_numpy()
+        if not kept.any():
+            return deduplicator.filter(df, source=key)
+        return pd.concat([df[kept], deduplicator.filter(df[~kept], source=key)]).sort_index()
+
+    def __read_source(self, filename: str, columns: list = None) -> pd.DataFrame:
+        """
+        :param filename: source filename
+        :param columns: list of columns, None for all columns
+        :return: Pandas DataFrame of the data cached for a source file
+        """
+        key = self.__manifest_key(filename)
+        part_name = self.__partition_filename(key)
+        frames = [pd.read_parquet(os.path.join(self._directory, date, part_name), columns=columns)
+                  for date in self._manifest[key]['partitions']]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def is_compact(self) -> bool:
+        """
+        :return: bool, True if data is stored in the compact TransactionSchema
+        """
+        return self._compact
+
+    def get_errors(self) -> dict:
+        """
+        :return: dict, filename and error message of files that failed to parse
+        during the last update
+        """
+        return self._errors
+
+    def is_changed(self, filename: str) -> bool:
+        """
+        :param filename: source filename
+        :return: bool, True if the file is not cached or has changed since
+        """
+        entry = self._manifest.get(self.__manifest_key(filename))
+        stat = os.stat(filename)
+        return entry is None or entry['size'] != stat.st_size \
+            or entry['mtime'] != stat.st_mtime_ns
+
+    def add_dataframe(self, filename: str, df: pd.DataFrame):
+        """
+        Write the parsed data of a source file to the cache, replacing any data
+        previously cached for it
+        :param filename: source filename
+        :param df: parsed dataframe
+        """
+        key = self.__manifest_key(filename)
+        self.__remove_partitions(key)
+        df = self.__prepare_dataframe(df)
+        part_name = self.__partition_filename(key)
+        dates = df[self._datetime_field].dt.strftime('%Y-%m-%d').fillna(self._undated_partition)
+        partitions = []
+        for date, df_date in df.groupby(dates, sort=True):
+            os.makedirs(os.path.join(self._directory, date), exist_ok=True)
+            df_date.to_parquet(os.path.join(self._directory, date, part_name), index=False)
+            partitions.append(date)
+
+        stat = os.stat(filename)
+        self._manifest[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                               'partitions': partitions}
+        self.__save_manifest()
+
+    def read(self, start=None, end=None, columns: list = None,
+             deduplicator: TransactionDeduplicator = None) -> pd.DataFrame:
+        """
+        Read cached data between start and end, inclusive. Only the partitions
+        of the requested dates and the requested columns are read.
+        :param start: datetime, None for no lower bound
+        :param end: datetime, None for no upper bound
+        :param columns: list of columns, None for all columns
+        :param deduplicator: TransactionDeduplicator. Default None. If set,
+        transactions already seen are dropped as each partition is read, and
+        duplicates are counted per source file
+        :return: Pandas DataFrame
+        """
+        start_date = None if start is None else pd.Timestamp(start).strftime('%Y-%m-%d')
+        end_date = None if end is None else pd.Timestamp(end).strftime('%Y-%m-%d')
+        read_columns = columns
+        if columns is not None:
+            read_columns = list(columns)
+            if self._datetime_field not in read_columns:
+                read_columns.append(self._datetime_field)
+            if deduplicator is not None and 'TRX_ID' not in read_columns:
+                read_columns.append('TRX_ID')
+
+        paths = []
+        for filename, entry in self._manifest.items():
+            part_name = self.__partition_filename(filename)
+            for date in entry['partitions']:
+                if date == self._undated_partition:
+                    if start is None and end is None:
+                        paths.append((date, part_name, filename))
+                elif (start_date is None or date >= start_date) and \
+                        (end_date is None or date <= end_date):
+                    paths.append((date, part_name, filename))
+        if len(paths) == 0:
+            return pd.DataFrame(columns=columns)
+
+        frames = []
+        for date, part_name, filename in sorted(paths):
+            df_part = pd.read_parquet(os.path.join(self._directory, date, part_name),
+                                      columns=read_columns)
+            if deduplicator is not None:
+                df_part = deduplicator.filter(df_part, source=filename)
+            frames.append(df_part)
+        df = pd.concat(frames, ignore_index=True)
+        if start is not None:
+            df = df[df[self._datetime_field] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df[self._datetime_field] <= pd.Timestamp(end)]
+        if columns is not None:
+            df = df[columns]
+        if self._compact:
+            # categories differ between partitions
+            df = TransactionSchema.apply(df)
+        return df.reset_index(drop=True)
+
+    @staticmethod
+    def __manifest_key(filename: str) -> str:
+        """
+        :param filename: source filename
+        :return: absolute filename the source file is recorded under in the manifest
+        """
+        return os.path.abspath(filename)
+
+    @staticmethod
+    def __partition_filename(filename: str) -> str:
+        """
+        :param filename: source filename
+        :return: filename used for the partitions of a source file
+        """
+        return hashlib.md5(filename.encode()).hexdigest() + '.parquet'
+
+    def __prepare_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the datetime field if missing, and store mixed type columns as
+        strings so they can be written to Parquet
+        :param df: parsed dataframe
+        :return: Pandas DataFrame
+        """
+        df = df.copy()
+        if self._datetime_field not in df.columns:
+            df[self._datetime_field] = pd.to_datetime(df[self._datetime_source_field])
+        for column in df.columns:
+            if df[column].dtype == object and \
+                    pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        return df
+
+    def __remove_partitions(self, filename: str):
+        """
+        Delete cached partitions of a source file
+        :param filename: source filename
+        """
+        key = self.__manifest_key(filename)
+        entry = self._manifest.pop(key, None)
+        if entry is None:
+            return
+        part_name = self.__partition_filename(key)
+        for date in entry['partitions']:
+            path = os.path.join(self._directory, date, part_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __load_manifest(self):
+        """
+        Read manifest from cache directory
+        """
+        path = os.path.join(self._directory, self._manifest_filename)
+        self._manifest = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._manifest = json.load(f)
+
+    def __save_manifest(self):
+        """
+        Write manifest to cache directory. Written to a temporary file first so
+        an interrupted write does not corrupt the manifest.
+        """
+        path = os.path.join(self._directory, self._manifest_filename)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._manifest, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+class IngestionService:
+    """
+    Long-running ingestion loop for a drop directory. Each new transaction or trip
+    file is parsed once, appended to a TripDataCache, and the new data is passed
+    to the downstream stages. The cache manifest is the durable checkpoint, so a
+    restart does not parse processed files again. Files are only ingested once
+    they have not been modified for settle_seconds, so partially copied files are
+    skipped until complete.
+    """
+    _directory: str = ''
+    _cache: TripDataCache = None
+    _file_keyword: str = ''
+    _file_types: list = ['csv', 'xlsx', 'xlsm']
+    _poll_interval: float = 60
+    _settle_seconds: float = 10
+    _processes: int = 1
+    _stages: list = []
+    _failed: dict = {}  # filename (size, mtime) of files that failed to parse
+    _deduplicator: TransactionDeduplicator = None
+
+    def __init__(self, directory: str, cache: TripDataCache = None, file_keyword: str = '',
+                 poll_interval: float = 60, settle_seconds: float = 10, processes: int = 1,
+                 deduplicator: TransactionDeduplicator = None):
+        """
+        :param directory: drop directory to watch
+        :param cache: TripDataCache the files are appended to. Default is a cache
+        in the trip_data_cache directory
+        :param file_keyword: only ingest files with this keyword in the filename
+        :param poll_interval: seconds between directory scans
+        :param settle_seconds: seconds a file must be unmodified before ingesting
+        :param processes: number of worker processes used to parse files
+        :param deduplicator: TransactionDeduplicator. Default None. If set,
+        transactions already seen are dropped before files are written to the
+        cache and passed to the downstream stages, and the index is saved after
+        each poll if it has a filename
+        """
+        self._directory = directory
+        self._deduplicator = deduplicator
+        self._cache = TripDataCache() if cache is None else cache
+        self._file_keyword = file_keyword
+        self._poll_interval = poll_interval
+        self._settle_seconds = settle_seconds
+        self._processes = processes
+        self._stages = []
+        self._failed = {}
+
+    def add_stage(self, stage):
+        """
+        Add a downstream stage. Stages are called in order after each poll that
+        ingests files, with the dataframe of the new files.
+        :param stage: callable taking a Pandas DataFrame
+        """
+        self._stages.append(stage)
+
+    def get_failed_files(self) -> dict:
+        """
+        :return: dict of files that failed to parse. They are retried once changed
+        """
+        return self._failed
+
+    def find_new_files(self) -> list:
+        """
+        :return: list of settled files in the drop directory that are not cached
+        or have changed
+        """
+        now = time.time()
+        out = []
+        for name in sorted(os.listdir(self._directory)):
+            filename = os.path.join(self._directory, name)
+            if self._file_keyword not in name or TransactionFile.get_file_type(name) not in self._file_types \
+                    or not os.path.isfile(filename):
+                continue
+            try:
+                stat = os.stat(filename)
+                if now - stat.st_mtime < self._settle_seconds:
+                    continue
+                if self._failed.get(filename) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                if self._cache.is_changed(filename):
+                    out.append(filename)
+            except OSError:
+                # removed since the directory was listed
+                continue
+        return out
+
+    def poll(self) -> list:
+        """
+        Ingest new files once and run the downstream stages on their data
+        :return: list of ingested filenames
+        """
+        filenames = self.find_new_files()
+        if len(filenames) == 0:
+            return []
+
+        frames = dict(self._cache.iter_update(filenames, self._processes, self._deduplicator))
+        for filename, error in self._cache.get_errors().items():
+            print('Failed to ingest ' + filename + ': ' + error)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                # removed since the poll started
+                continue
+            self._failed[filename] = (stat.st_size, stat.st_mtime_ns)
+
+        ingested = [i for i in filenames if i in frames]
+        if len(ingested) > 0 and self._deduplicator is not None \
+                and self._deduplicator.get_filename() is not None:
+            self._deduplicator.save()
+        if len(ingested) > 0:
+            df_new = pd.concat([frames[i] for i in ingested])
+            if self._cache.is_compact():
+                df_new = TransactionSchema.apply(df_new)
+            for stage in self._stages:
+                stage(df_new)
+        return ingested
+
+    def run(self, max_polls: int = None):
+        """
+        Watch the drop directory until interrupted, or for max_polls polls
+        :param max_polls: int. Default None, run until interrupted
+        """
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                ingested = self.poll()
+                if len(ingested) > 0:
+                    print('Ingested ' + str(len(ingested)) + ' files')
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(self._poll_interval)
+        except KeyboardInterrupt:
+            print('Ingestion stopped')
+
+
 class AVITest:
     """
     Class to perform AVI testing. The default test is a minimum of 30 days, but can be set to be longer.
     This was determined based on experience and practicality of completing and auditing irregularities
     in the test results.
 
-    Imports files from working directory and creates a pickle file. If a pickle file from a previous
-    run exists, then it is used.
+    Imports files from working directory into a columnar cache. Files cached by a previous run are
+    not parsed again unless they have changed.
     """
     _df_full: pd.DataFrame = None
+    _datetime_index: np.ndarray = None
     _start_date: np.datetime64 = None
     _plate_tag_dict: dict = {}
     _error_count: int = 0
-    _trip_pkl_output_filename: str = 'trip_data.pkl'
+    _trip_cache_directory: str = 'trip_data_cache'
     _trip_file_keyword: str = 'TripTxn'
-    _export_data_to_pickle: bool = True
+    _export_data_to_cache: bool = True
     _test_days: np.datetime64 = None
     _n_plates: int = 0
     _export_error_dataframe: bool = False
     _test_result: float = 0.0
     _export_dataframe_filename: str = 'Transactions_w_Errors.csv'
+    _trial_results: pd.DataFrame = None
+    _deduplicate: bool = True
+    _duplicate_counts: dict = {}
+    _trial_fields: list = ['DATETIME', 'TAG_ID', 'PLATE', 'TRX_ID']
+    _data_start: datetime.datetime = None
+    _data_end: datetime.datetime = None
 
     def get_test_result(self) -> float:
         """
@@ -722,10 +2393,23 @@ class AVITest:
         :param n_plates: number of plate/tag used for analysis. Setting to 0 uses
         an unlimited size dictionary
         """
+        self.set_dataframe(dataframe)
         self.set_test_duration(test_days)
         self.set_plate_tag_count(n_plates)
         self.set_export_error_dataframe(export_dataframe_errors)
 
+    def set_data_range(self, start: datetime.datetime = None, end: datetime.datetime = None):
+        """
+        Set the date range of trip data imported for analysis. Only the cache
+        partitions in the range are read.
+        :param start: datetime, None for no lower bound
+        :param end: datetime, None for no upper bound
+        """
+        if start is not None and end is not None and start > end:
+            raise ValueError('Start ' + str(start) + ' is after end ' + str(end))
+        self._data_start = start
+        self._data_end = end
+
     def set_plate_tag_count(self, value: int):
         """
         Set the plate/tag dictionary size
@@ -743,6 +2427,30 @@ class AVITest:
         if isinstance(dataframe, pd.DataFrame) and dataframe.empty:
             raise TypeError('Dataframe cannot be empty')
         self._df_full = dataframe
+        self.__index_by_datetime()
+
+    def __index_by_datetime(self):
+        """
+        Sort the dataframe by DATETIME once and keep the sorted datetime values,
+        so test windows can be found with a binary search instead of a scan.
+        """
+        if self._df_full is None:
+            self._datetime_index = None
+            return
+        self._df_full = self._df_full.sort_values(by='DATETIME', kind='stable')
+        self._datetime_index = self._df_full['DATETIME'].values
+
+    def __select_window(self, start: np.datetime64, end: np.datetime64) -> pd.DataFrame:
+        """
+        Select transactions between start and end, inclusive. Returns a slice
+        of the sorted dataframe.
+        :param start: window start
+        :param end: window end
+        :return: Pandas DataFrame
+        """
+        first = np.searchsorted(self._datetime_index, np.datetime64(start), side='left')
+        last = np.searchsorted(self._datetime_index, np.datetime64(end), side='right')
+        return self._df_full.iloc[first:last]
 
     def set_test_duration(self, value: np.timedelta64):
         """
@@ -756,9 +2464,10 @@ class AVITest:
         else:
             self._test_days = value
 
-    def __set_start_date(self):
+    def __available_start_dates(self) -> pd.DatetimeIndex:
         """
-        Find random test start date
+        All start dates that leave a full test duration of data
+        :return: Pandas DatetimeIndex
         """
         min_date = self._df_full['DATETIME'].min()
         max_date = self._df_full['DATETIME'].max()
@@ -767,7 +2476,13 @@ class AVITest:
             raise ValueError(str(difference) + 'is less than the number of required'
                                                'test days of ' + str(self._test_days))
         range_max = max_date - self._test_days
-        available_dates = pd.date_range(start=min_date, end=range_max, freq='D')
+        return pd.date_range(start=min_date, end=range_max, freq='D')
+
+    def __set_start_date(self):
+        """
+        Find random test start date
+        """
+        available_dates = self.__available_start_dates()
         self._start_date = pd.Series(available_dates).sample(n=1).values[0]
 
     def __build_tag_dictionary(self):
@@ -775,17 +2490,17 @@ class AVITest:
         Create plate/tag dictionary for the first half of the test duration time
         period.
         """
-        print('Building plate/tag dictionary')
         end_date = self._start_date + self._test_days / 2
-        df_tag = self._df_full[(self._df_full['DATETIME'] >= self._start_date)
-                               & (self._df_full['DATETIME'] <= end_date)]
-        validation = AVIValidation(dataframe=df_tag)
+        df_tag = self.__select_window(self._start_date, end_date)
+        validation = AVIValidation(plate_tag_dict_name={}, dataframe=df_tag,
+                                   export_dict=False)
         validation.find_and_mark_missed_avi_reads()
 
         # limit plate/tag dict if n != 0
         df_out = pd.DataFrame(validation.get_plate_tag_dict()).T
         if self._n_plates != 0:
-            df_out = df_out.sort_values(by=1, ascending=False)
+            # ties keep the order plates were first read
+            df_out = df_out.sort_values(by=1, ascending=False, kind='stable')
             df_out = df_out.head(self._n_plates)
         self._plate_tag_dict = self.__dict_from_dataframe(df_out)
 
@@ -806,23 +2521,37 @@ class AVITest:
 
     def __import_analysis_files(self):
         """
-        Create pickle file or import files and create a pickle file. Creating
-        pickle files reduces time for future script executions.
+        Import trip files from the working directory. Files are cached in a
+        columnar cache, and only new or changed files are parsed again, which
+        reduces time for future script executions.
         """
         all_files = os.listdir(os.getcwd())
-        if self._trip_pkl_output_filename in all_files:
-            print('Using existing pickle file')
-            self._df_full = pd.read_pickle(self._trip_pkl_output_filename)
+        trip_files = [i for i in all_files if 'csv' in i
+                      and self._trip_file_keyword in i]
+        deduplicator = TransactionDeduplicator() if self._deduplicate else None
+        if self._export_data_to_cache:
+            cache = TripDataCache(self._trip_cache_directory)
+            print('Update trip data cache')
+            cache.update(trip_files)
+            df_all = cache.read(self._data_start, self._data_end, deduplicator=deduplicator)
         else:
-            print('Build pickle file')
-            trip_files = [i for i in all_files if 'csv' in i
-                          and self._trip_file_keyword in i]
-            df_all = pd.concat([TripFile(i).get_df() for i in trip_files])
+            df_all = ParallelFileReader(trip_files, file_class=TripFile).read(deduplicator)
             if 'DATETIME' not in df_all.columns:
                 df_all['DATETIME'] = pd.to_datetime(df_all['Entry Time'])
-            self._df_full = df_all
-            if self._export_data_to_pickle:
-                df_all.to_pickle(self._trip_pkl_output_filename)
+            if self._data_start is not None:
+                df_all = df_all[df_all['DATETIME'] >= pd.Timestamp(self._data_start)]
+            if self._data_end is not None:
+                df_all = df_all[df_all['DATETIME'] <= pd.Timestamp(self._data_end)]
+        if deduplicator is not None:
+            self._duplicate_counts = deduplicator.get_duplicate_counts()
+            print('Duplicate transactions dropped: ' + str(sum(self._duplicate_counts.values())))
+        self.set_dataframe(df_all)
+
+    def get_duplicate_counts(self) -> dict:
+        """
+        :return: dict, trip file and number of duplicate transactions dropped on import
+        """
+        return self._duplicate_counts
 
     def __execute_avi_test(self):
         """
@@ -836,8 +2565,7 @@ class AVITest:
         # filter dataframe for analysis period
         start = self._start_date + self._test_days / 2
         end = start + self._test_days / 2
-        df_test = self._df_full[(self._df_full['DATETIME'] >= start)
-                                & (self._df_full['DATETIME'] <= end)]
+        df_test = self.__select_window(start, end)
 
         # run analysis
         validation = AVIValidation(plate_tag_dict_name=self._plate_tag_dict,
@@ -864,16 +2592,246 @@ class AVITest:
     def run_analysis(self):
         """
         Run AVI analysis:
-        1. Import files for analysis, or use existing pickle file
+        1. Import files for analysis, or use the cached files
         2. Select a random start date from the available start dates
         3. Build plate/tag dictionary
         4. Run the AVI test and compute the metrics
         """
-        self.__import_analysis_files()
+        if self._df_full is None:
+            self.__import_analysis_files()
         self.__set_start_date()
+        print('Building plate/tag dictionary')
         self.__build_tag_dictionary()
         self.__execute_avi_test()
 
+    def _run_trial(self, start_date: np.datetime64) -> float:
+        """
+        Build the plate/tag dictionary and run the AVI test for one start date
+        :param start_date: test start date
+        :return: float, result
+        """
+        self._start_date = np.datetime64(start_date)
+        self.__build_tag_dictionary()
+        self.__execute_avi_test()
+        return self._test_result
+
+    def run_trials(self, n_trials: int = 100, all_windows: bool = False,
+                   processes: int = None, confidence: float = 0.95,
+                   random_state: int = None) -> dict:
+        """
+        Run the AVI test over many start dates in a process pool. Only the
+        fields used by the trials are handed to each worker, once, when the
+        worker starts.
+        :param n_trials: number of randomly sampled start dates
+        :param all_windows: bool. Default False. Run every available start date
+        instead of sampling n_trials
+        :param processes: number of worker processes. None uses all cores, 1 runs
+        the trials in the current process
+        :param confidence: confidence level for the reported intervals
+        :param random_state: seed for sampling start dates
+        :return: dict, summary of the trial results
+        """
+        if n_trials < 1:
+            raise ValueError(str(n_trials) + ' is Invalid. Value must be at least 1')
+        if not 0 < confidence < 1:
+            raise ValueError('Confidence must be between 0 and 1')
+        if self._df_full is None:
+            self.__import_analysis_files()
+
+        available_dates = pd.Series(self.__available_start_dates())
+        if all_windows:
+            start_dates = available_dates.values
+        else:
+            replace = n_trials > available_dates.shape[0]
+            start_dates = available_dates.sample(n=n_trials, replace=replace,
+                                                 random_state=random_state).values
+
+        if processes == 1:
+            results = [self._run_trial(i) for i in start_dates]
+        else:
+            df_trial = self._df_full[[i for i in self._trial_fields if i in self._df_full.columns]]
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_avi_trial_worker,
+                                     initargs=(df_trial, self._test_days,
+                                               self._n_plates)) as executor:
+                results = list(executor.map(_run_avi_trial_worker, start_dates))
+
+        self._trial_results = pd.DataFrame({'START_DATE': start_dates, 'RESULT': results})
+        return self.get_trial_summary(confidence)
+
+    def get_trial_results(self) -> pd.DataFrame:
+        """
+        :return: DataFrame of trial start dates and results
+        """
+        return self._trial_results
+
+    def get_trial_summary(self, confidence: float = 0.95) -> dict:
+        """
+        Summarize the distribution of trial results. The confidence interval is
+        for the mean result, the percentile interval is for a single window.
+        :param confidence: confidence level for the reported intervals
+        :return: dict, summary of the trial results
+        """
+        if self._trial_results is None:
+            raise ValueError('No trial results, execute run_trials first')
+        results = self._trial_results['RESULT'].values
+        n = results.shape[0]
+        mean = float(results.mean())
+        std = float(results.std(ddof=1)) if n > 1 else 0.0
+        z_value = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        margin = float(z_value * std / np.sqrt(n))
+        tail = (1 - confidence) / 2
+        worst = int(results.argmin())
+        return {'n_trials': n,
+                'mean': mean,
+                'std': std,
+                'ci_low': mean - margin,
+                'ci_high': mean + margin,
+                'percentile_low': float(np.quantile(results, tail)),
+                'percentile_high': float(np.quantile(results, 1 - tail)),
+                'worst_result': float(results[worst]),
+                'worst_start_date': self._trial_results['START_DATE'].iloc[worst]}
+
+    def run_rolling_analysis(self, read_threshold: int = 5) -> pd.Series:
+        """
+        Compute the AVI test result for every start date in a single pass. The
+        training and test halves slide forward one day at a time, adding the
+        reads of the day entering each half and removing the day leaving it.
+        Windows are whole days, and the dictionary is limited by n_plates.
+        :param read_threshold: Default 5. Plate/tag reads required before an
+        error is recorded.
+        :return: Pandas Series of results indexed by start date
+        """
+        if self._df_full is None:
+            self.__import_analysis_files()
+
+        days = self._df_full['DATETIME'].dt.floor('D')
+        daily_counts = self.__daily_plate_tag_counts(days)
+        daily_transactions = days.value_counts()
+        first_day = days.min()
+        n_days = (days.max() - first_day).days + 1
+        half = int(self._test_days / np.timedelta64(1, 'D')) // 2
+        if n_days < 2 * half:
+            raise ValueError(str(n_days) + ' days is less than the number of required'
+                                           ' test days of ' + str(self._test_days))
+        day_list = [first_day + pd.Timedelta(days=i) for i in range(n_days)]
+        window = PlateTagWindow(read_threshold, self._n_plates)
+
+        def update(day_index: int, training: bool, sign: int):
+            day = day_list[day_index]
+            counts = daily_counts.get(day, [])
+            if training:
+                window.update_training(counts, day, sign)
+            else:
+                window.update_testing(counts, int(daily_transactions.get(day, 0)), sign)
+
+        for i in range(half):
+            update(i, True, 1)
+            update(i + half, False, 1)
+        results = [window.get_accuracy()]
+        for start in range(1, n_days - 2 * half + 1):
+            update(start - 1, True, -1)
+            update(start + half - 1, True, 1)
+            update(start + half - 1, False, -1)
+            update(start + 2 * half - 1, False, 1)
+            results.append(window.get_accuracy())
+
+        return pd.Series(results, index=pd.DatetimeIndex(day_list[:len(results)]),
+                         name='RESULT')
+
+    def __daily_plate_tag_counts(self, days: pd.Series) -> dict:
+        """
+        Count plate/tag reads per day, skipping blank plates. The dataframe is
+        sorted by DATETIME, so the first entry of a plate is its first read.
+        :param days: Pandas Series, day of each transaction
+        :return: dict, day [(plate, tag, reads)]
+        """
+        df = pd.DataFrame({'DAY': days, 'PLATE': self._df_full['PLATE'],
+                           'TAG_ID': self._df_full['TAG_ID']})
+        df = df[df['PLATE'].notna() & (df['PLATE'] != '')]
+        sizes = df.groupby(['DAY', 'PLATE', 'TAG_ID'], dropna=False, sort=False,
+                           observed=True).size()
+        out = {}
+        for (day, plate, tag), reads in sizes.items():
+            tag = None if pd.isna(tag) else float(tag)
+            out.setdefault(day, []).append((plate, tag, int(reads)))
+        return out
+
+
+def _broadcast_variants(codes: np.ndarray, variants: list) -> pd.DataFrame:
+    """
+    Broadcast the variants of each unique plate back to the rows
+    :param codes: array of unique plate codes per row, -1 for missing plates
+    :param variants: list of variants per unique plate
+    :return: Pandas DataFrame of ROW and VARIANT, in row order
+    """
+    n_variants = np.array([len(i) for i in variants] + [0], dtype=np.int64)  # code -1 last
+    variant_starts = np.cumsum(n_variants) - n_variants
+    row_counts = n_variants[codes]
+    rows = np.repeat(np.arange(codes.shape[0]), row_counts)
+    row_starts = np.cumsum(row_counts) - row_counts
+    variant_positions = np.repeat(variant_starts[codes] - row_starts, row_counts) + \
+        np.arange(rows.shape[0])
+    all_variants = np.array([j for i in variants for j in i], dtype=object)
+    return pd.DataFrame({'ROW': rows, 'VARIANT': all_variants[variant_positions]})
+
+
+def _read_file_worker(file_class: type, filename: str, compact: bool = False) -> pd.DataFrame:
+    """
+    Process pool task to parse a single file
+    :param file_class: class used to parse the file
+    :param filename: filename
+    :param compact: convert to the compact TransactionSchema
+    :return: Pandas DataFrame
+    """
+    return file_class(filename, compact=compact).get_df()
+
+
+def _read_bytes_worker(filename: str) -> bytes:
+    """
+    Thread task to read the raw contents of a file
+    :param filename: filename
+    :return: bytes
+    """
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def _read_buffer_worker(file_class: type, filename: str, buffer: bytes,
+                        compact: bool = False) -> pd.DataFrame:
+    """
+    Process pool task to parse the raw contents of a single file
+    :param file_class: class used to parse the file
+    :param filename: filename, used for the file type
+    :param buffer: raw file contents
+    :param compact: convert to the compact TransactionSchema
+    :return: Pandas DataFrame
+    """
+    return file_class(filename, compact=compact, buffer=buffer).get_df()
+
+
+_avi_trial_test: AVITest = None
+
+
+def _init_avi_trial_worker(dataframe: pd.DataFrame, test_days: np.timedelta64, n_plates: int):
+    """
+    Process pool initializer. Creates one AVI test per worker process from the
+    fields used by the trials.
+    :param dataframe: Pandas DataFrame sorted by DATETIME
+    :param test_days: test duration
+    :param n_plates: number of plate/tag used for analysis
+    """
+    global _avi_trial_test
+    _avi_trial_test = AVITest(dataframe, test_days, n_plates)
+
+
+def _run_avi_trial_worker(start_date: np.datetime64) -> float:
+    """
+    Process pool task to run a single AVI trial
+    :param start_date: test start date
+    :return: float, result
+    """
+    return _avi_trial_test._run_trial(start_date)
+
 
 if __name__ == '__main__':
     print('Test is the toll data module')
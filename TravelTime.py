@@ -3,6 +3,8 @@ import logging
 from tqdm import tqdm
 import datetime
 import numpy as np
+from collections import OrderedDict
+import CorridorTopology as ct
 
 
 class TravelTime:
@@ -15,17 +17,16 @@ class TravelTime:
     _data_date = None
     _default_log_level = logging.INFO
     _default_field_names = {'datetime_field': 'DATETIME', 'plaza_field': 'Plaza', 'trip_field': 'Trip ID'}
-    _toll_locations_in_feet = {
-        'NB01': 389809, 'NB02': 389809, 'NB03': 405301, 'NB04': 421240, 'NB05': 425175,
-        'NB06': 426828, 'NB07': 433800, 'NB08': 453800, 'NB09': 465100, 'NB10': 471090
-        , 'SB01': 468200, 'SB02': 459870, 'SB03': 451800, 'SB04': 433770, 'SB05': 428820,
-        'SB06': 426798, 'SB07': 425145, 'SB08': 410272, 'SB09': 399420, 'SB10': 389779,
-        'SB11': 389779
-    }
+    _topology = None
+    _route_cache_size = 128
+    _route_cache = None  # route (travel times per minute)
+    _route_cache_frame = None
+    _pair_aggregates = None  # pair {time: (total travel time, trips)}
+    _pair_trip_seconds = None  # pair {time: [travel time of each trip in seconds]}
 
     def __init__(self, df: pd.DataFrame, datetime_field_name=None,
                  plaza_field_name=None, trip_field_name=None, enable_logging=False,
-                 default_logging_level=logging.INFO, toll_locations=None):
+                 default_logging_level=logging.INFO, toll_locations=None, topology=None):
         """
         Constructor travel time object. Must create before travel times can be calculated.
         :param df: Pandas Dataframe
@@ -35,7 +36,11 @@ class TravelTime:
         :param enable_logging: Bool.
         :param default_logging_level: Int. Set logging level, default to INFO
         :param toll_locations: Dict. Name: Location (ft). Used to calculate baseline values
-        for free flow traffic, and travel time between toll points.
+        for free flow traffic, and travel time between toll points. Default None, the
+        corridor topology config is used.
+        :param topology: CorridorTopology. Used for pair distances and free flow travel
+        times instead of toll_locations. Default None, created from toll_locations, or
+        loaded from the corridor topology config with CorridorTopology.from_json.
         """
         self._initialize_logging(enable_logging, default_logging_level)
 
@@ -43,10 +48,13 @@ class TravelTime:
         constructor_fields = {'datetime_field': datetime_field_name, 'plaza_field': plaza_field_name,
                               'trip_field': trip_field_name}
         self._set_field_names(constructor_fields)
-        self._set_toll_locations(toll_locations)
+        self._set_toll_locations(toll_locations, topology)
 
         # Build trips
         pairs = self._calculate_travel_pairs(df)
+        self._pair_aggregates = {}
+        self._pair_trip_seconds = {}
+        self._fold_travel_pairs(pairs)
         avg_pairs = self.average_travel_times(pairs)
         df_travel_time = self._create_summary_dataframe_skeleton(avg_pairs)
         self.df_travel_time = self._interpolate_missing_travel_times(df_travel_time)
@@ -58,9 +66,12 @@ class TravelTime:
                                 datefmt='%m/%d/%Y %H:%M:%S', filename='travel_time_log.log',
                                 level=log_level)
 
-    def _set_toll_locations(self, toll_locations: dict):
-        if toll_locations is not None:
-            self._toll_locations_in_feet = toll_locations
+    def _set_toll_locations(self, toll_locations: dict, topology=None):
+        if topology is None and toll_locations is not None:
+            topology = ct.CorridorTopology.from_locations(toll_locations, 3600 / self.FREE_FLOW_SPEED / 5280)
+        elif topology is None:
+            topology = ct.CorridorTopology.from_json()
+        self._topology = topology
 
     def _set_field_names(self, field_value_dict: dict):
         logging.debug('Set constructor Field Names: ' + str(field_value_dict))
@@ -86,19 +97,142 @@ class TravelTime:
 
     def get_travel_time_all_day(self, trip_definition: list) -> list:
         logging.info('Get travel times for entire day for trip: ' + str(trip_definition))
-        # Start date will be removed, any arbitrary date may be used
-        minutes_in_day_list = [datetime.datetime(2021, 1, 1)]
-        start_time = minutes_in_day_list[0]
-        # Generate list of all minutes in day
-        for i in range(self.MINUTES_IN_DAY):
-            start_time = start_time + datetime.timedelta(minutes=1)
-            minutes_in_day_list.append(start_time)
-        # Get travel times and return output
-        output = []
-        for time in minutes_in_day_list:
-            output.append(self.get_travel_time(time, trip_definition))
+        return self.get_route_profile(trip_definition).tolist()
+
+    def get_travel_times(self, start_times, trip_definitions: list) -> np.ndarray:
+        """
+        Return travel times for many departures at once. Departures are grouped by route,
+        and each route is looked up in its cached all-day profile, so repeated routes
+        cost an array index. Departure times are taken to the minute.
+        :param start_times: list or Series of datetime.datetime departure times
+        :param trip_definitions: list of routes, one list of toll trip points per departure
+        :return: Float array. Travel times in seconds, in departure order. NaN for routes
+        with a pair that has no travel times.
+        """
+        start_times = pd.DatetimeIndex(start_times)
+        if len(trip_definitions) != start_times.shape[0]:
+            raise ValueError('Number of routes does not match number of start times')
+        minutes = (start_times.hour * 60 + start_times.minute).to_numpy()
+        routes = {}
+        for c, route in enumerate(trip_definitions):
+            routes.setdefault(tuple(route), []).append(c)
+
+        output = np.full(start_times.shape[0], np.nan)
+        for route, positions in routes.items():
+            output[positions] = self._get_route_profile(list(route))[minutes[positions]]
         return output
 
+    def get_route_profile(self, trip_definition: list) -> np.ndarray:
+        """
+        Return travel times of a route for every minute of the day. Profiles are kept in
+        a bounded cache, which is cleared when df_travel_time is replaced.
+        :param trip_definition: list of toll trip points
+        :return: Float array. Travel times in seconds per departure minute.
+        :raises KeyError: if a pair of the route has no travel times
+        """
+        for i in range(1, len(trip_definition)):
+            pair = trip_definition[i - 1] + '-' + trip_definition[i]
+            if pair not in self.df_travel_time.columns:
+                raise KeyError(pair)
+        return self._get_route_profile(trip_definition)
+
+    def _get_route_profile(self, trip_definition: list) -> np.ndarray:
+        """
+        :param trip_definition: list of toll trip points
+        :return: Float array. Travel times in seconds per departure minute, NaN if a pair
+        of the route has no travel times.
+        """
+        if self._route_cache is None or self._route_cache_frame is not self.df_travel_time:
+            self.clear_route_cache()
+        route = tuple(trip_definition)
+        if route in self._route_cache:
+            self._route_cache.move_to_end(route)
+            return self._route_cache[route]
+
+        logging.debug('Calculate route profile: ' + str(trip_definition))
+        minutes = np.arange(self.df_travel_time.shape[0])
+        profile = np.zeros(minutes.shape[0])
+        for i in range(1, len(trip_definition)):
+            pair_travel_times = self._get_pair_travel_times(trip_definition[i - 1] + '-' + trip_definition[i])
+            arrival_minutes = minutes if i == 1 else self._get_arrival_minutes(minutes, profile)
+            profile = profile + pair_travel_times[arrival_minutes]
+        profile.flags.writeable = False
+
+        self._route_cache[route] = profile
+        if len(self._route_cache) > self._route_cache_size:
+            self._route_cache.popitem(last=False)
+        return profile
+
+    def get_reliability_metrics(self, trip_definition: list, bins: list = None,
+                                percentile: float = 95) -> pd.DataFrame:
+        """
+        Return travel time reliability metrics of a route per time of day bin. The observed
+        distribution in a bin has one route travel time per trip observed on the first pair of
+        the route: the route travel time of its departure minute, plus the difference between
+        the trip and the average of that minute on the first pair. Interpolated minutes are
+        not used, and the baseline is the free flow travel time of the route.
+        - TTI, travel time index: mean / free flow
+        - PTI, planning time index: percentile / free flow
+        - BI, buffer index: (percentile - mean) / mean
+        :param trip_definition: list of toll trip points
+        :param bins: list of increasing bin edges in hours, from 0 to 24. Default None, hourly bins.
+        :param percentile: Float. Default 95. Percentile used for PTI and BI.
+        :return: DataFrame indexed by bin with FREE_FLOW, TRIPS, MEAN, PERCENTILE, TTI, PTI, and BI.
+        Travel times in seconds, NaN for bins without trips.
+        """
+        logging.info('Get reliability metrics for trip: ' + str(trip_definition))
+        if bins is None:
+            bins = list(range(25))
+        edges = np.array(bins, dtype='float64') * 60
+        if edges.shape[0] < 2 or (np.diff(edges) <= 0).any():
+            raise ValueError('Bins must be at least two increasing edges')
+        labels = ['{:02d}:{:02d}-{:02d}:{:02d}'.format(int(edges[i] // 60), int(edges[i] % 60),
+                                                      int(edges[i + 1] // 60), int(edges[i + 1] % 60))
+                  for i in range(edges.shape[0] - 1)]
+        profile = self.get_route_profile(trip_definition)
+        minutes, offsets = self._get_observed_trip_offsets(trip_definition[0] + '-' + trip_definition[1])
+        bin_index = np.searchsorted(edges, minutes, side='right') - 1
+        in_bins = (bin_index >= 0) & (bin_index < len(labels))
+
+        travel_times = pd.Series(profile[minutes[in_bins]] + offsets[in_bins])
+        travel_times = travel_times.groupby(bin_index[in_bins])
+        free_flow = sum(self._compute_pair_free_flow_seconds(trip_definition[i - 1] + '-' + trip_definition[i])
+                        for i in range(1, len(trip_definition)))
+        df_out = pd.DataFrame({'TRIPS': travel_times.size(), 'MEAN': travel_times.mean(),
+                               'PERCENTILE': travel_times.quantile(percentile / 100)})
+        df_out = df_out.reindex(range(len(labels)))
+        df_out.index = pd.Index(labels, name='BIN')
+        df_out['TRIPS'] = df_out['TRIPS'].fillna(0).astype('int64')
+        df_out.insert(0, 'FREE_FLOW', free_flow)
+        df_out['TTI'] = df_out['MEAN'] / free_flow
+        df_out['PTI'] = df_out['PERCENTILE'] / free_flow
+        df_out['BI'] = (df_out['PERCENTILE'] - df_out['MEAN']) / df_out['MEAN']
+        return df_out
+
+    def _get_observed_trip_offsets(self, pair: str) -> tuple:
+        """
+        :param pair: str toll point pair, 'start-end'
+        :return: tuple of Int array, the minute of the day of each observed trip of the pair,
+        and Float array, the travel time of the trip minus the average of its minute in seconds
+        """
+        n = self.df_travel_time.shape[0]
+        minutes = []
+        offsets = []
+        for time, seconds in self._pair_trip_seconds.get(pair, {}).items():
+            position = self._get_minute_position(time)
+            if 0 <= position < n:
+                seconds = np.array(seconds)
+                minutes.extend([position] * seconds.shape[0])
+                offsets.extend(seconds - seconds.mean())
+        return np.array(minutes, dtype=np.int64), np.array(offsets, dtype='float64')
+
+    def clear_route_cache(self):
+        """
+        Clear cached route profiles. Required after df_travel_time is modified in place.
+        """
+        self._route_cache = OrderedDict()
+        self._route_cache_frame = self.df_travel_time
+
     def get_travel_time(self, start_time: datetime.datetime, trip_definition: list) -> float:
         """
         Return travel time for particular datetime instnaces. Requires creation of TravelTime
@@ -136,6 +270,135 @@ class TravelTime:
             start_time_min = TravelTimeUtil.round_minutes(TravelTimeUtil.round_seconds(start_time))
         return total_time
 
+    def get_travel_time_od_matrix(self, corridor: list) -> np.ndarray:
+        """
+        Return travel times between every origin and destination toll point of a corridor,
+        for every minute of the day. Uses dynamic programming along the corridor order:
+        the travel time from an origin to a toll point extends the travel time to the
+        previous toll point by the pair travel time at the minute it is reached. Values
+        match get_travel_time for each route.
+        :param corridor: list of toll points in travel order
+        :return: Float array [origin, destination, minute]. Travel times in seconds, NaN
+        where the destination is before the origin or a pair has no travel times.
+        """
+        logging.info('Get OD travel time matrix for corridor: ' + str(corridor))
+        n = len(corridor)
+        minutes = np.arange(self.df_travel_time.shape[0])
+        od_matrix = np.full((n, n, minutes.shape[0]), np.nan)
+        for i in range(n):
+            od_matrix[i, i, :] = 0
+
+        for j in range(1, n):
+            pair_travel_times = self._get_pair_travel_times(corridor[j - 1] + '-' + corridor[j])
+            elapsed = od_matrix[:j, j - 1, :]
+            arrival_minutes = self._get_arrival_minutes(minutes, elapsed)
+            # first pair of a route starts at the departure minute
+            arrival_minutes[j - 1, :] = minutes
+            od_matrix[:j, j, :] = elapsed + pair_travel_times[arrival_minutes]
+        return od_matrix
+
+    def _get_pair_travel_times(self, pair: str) -> np.ndarray:
+        """
+        :param pair: str toll point pair, 'start-end'
+        :return: Float array of travel times per minute of the day, NaN if the pair has
+        no travel times.
+        """
+        if pair not in self.df_travel_time.columns:
+            logging.debug('Pair not in travel times: ' + str(pair))
+            return np.full(self.df_travel_time.shape[0], np.nan)
+        return self.df_travel_time[pair].to_numpy(dtype='float64')
+
+    def _get_arrival_minutes(self, start_minutes: np.ndarray, elapsed: np.ndarray) -> np.ndarray:
+        """
+        Vectorized minute lookup of get_travel_time. Adds elapsed seconds to the start
+        minutes within the day, then rounds with TravelTimeUtil.round_seconds and
+        TravelTimeUtil.round_minutes.
+        :param start_minutes: Int array of start minutes in day
+        :param elapsed: Float array of elapsed seconds, broadcast with start_minutes
+        :return: Int array of minute positions in df_travel_time
+        """
+        seconds = np.minimum(start_minutes * 60 + np.nan_to_num(elapsed), self.MINUTES_IN_DAY * 60)
+        whole_seconds = np.floor(seconds)
+        whole_seconds += (seconds - whole_seconds) > 0.5
+        minutes = whole_seconds // 60 + np.where(whole_seconds % 60 > 30, 1, -1)
+        return np.clip(minutes, 0, self.df_travel_time.shape[0] - 1).astype(np.int64)
+
+    def update(self, df: pd.DataFrame) -> list:
+        """
+        Fold new trips into the travel times without rebuilding the object. The running
+        totals of each pair and minute are updated, and only the changed pairs are
+        interpolated again, between the observed minutes around the new data. Trips are
+        decomposed per update, so a trip split across updates does not add the pair
+        between its parts.
+        :param df: Pandas Dataframe of new trips, same fields and date as the original data
+        :return: list of pairs updated
+        """
+        logging.info('Update travel times')
+        pairs = self._calculate_travel_pairs(df)
+        for pair in pairs:
+            self.check_single_date([self._data_date] + list(pairs[pair].keys()))
+        self._fold_travel_pairs(pairs)
+
+        for pair in pairs:
+            minutes = [self._get_minute_position(i) for i in pairs[pair]]
+            self._update_pair_travel_times(pair, minutes)
+        self.clear_route_cache()
+        return list(pairs.keys())
+
+    def _fold_travel_pairs(self, pairs: dict):
+        """
+        Add travel pairs to the running totals and trip travel times of each pair and minute
+        :param pairs: dict, pair {time: [travel time]}
+        """
+        for pair in pairs:
+            aggregates = self._pair_aggregates.setdefault(pair, {})
+            trip_seconds = self._pair_trip_seconds.setdefault(pair, {})
+            for time in pairs[pair]:
+                total, trips = aggregates.get(time, (datetime.timedelta(seconds=0), 0))
+                aggregates[time] = (total + sum(pairs[pair][time], datetime.timedelta(seconds=0)),
+                                    trips + len(pairs[pair][time]))
+                trip_seconds.setdefault(time, []).extend(i.total_seconds() for i in pairs[pair][time])
+
+    def _get_minute_position(self, time: datetime.datetime) -> int:
+        """
+        :param time: datetime.datetime
+        :return: Int. Minutes since the start of the data date
+        """
+        day_start = datetime.datetime(self._data_date.year, self._data_date.month, self._data_date.day)
+        return int((time - day_start) / datetime.timedelta(minutes=1))
+
+    def _update_pair_travel_times(self, pair: str, minutes: list):
+        """
+        Interpolate the travel times of a pair again from its running totals. Existing
+        pairs are only updated between the observed minutes before and after the changed
+        minutes. New pairs are added for the whole day.
+        :param pair: str toll point pair, 'start-end'
+        :param minutes: list of changed minute positions
+        """
+        n = self.df_travel_time.shape[0]
+        observed = np.full(n, np.nan)
+        for time, (total, trips) in self._pair_aggregates[pair].items():
+            position = self._get_minute_position(time)
+            if 0 <= position < n:
+                average = total / trips
+                observed[position] = average.seconds + average.microseconds / 1_000_000
+        observed[0] = observed[n - 1] = self._compute_pair_free_flow_seconds(pair)
+        anchors = np.flatnonzero(~np.isnan(observed))
+
+        if pair not in self.df_travel_time.columns:
+            logging.debug('Add pair: ' + str(pair))
+            self.df_travel_time[pair] = np.interp(np.arange(n), anchors, observed[anchors])
+            return
+        minutes = [i for i in minutes if 0 <= i < n]
+        if len(minutes) == 0:
+            return
+        start = anchors[max(np.searchsorted(anchors, min(minutes), side='left') - 1, 0)]
+        end = anchors[min(np.searchsorted(anchors, max(minutes), side='right'), anchors.shape[0] - 1)]
+        logging.debug('Interpolate pair ' + str(pair) + ' minutes ' + str(start) + '-' + str(end))
+        column = self.df_travel_time.columns.get_loc(pair)
+        self.df_travel_time.iloc[start:end + 1, column] = np.interp(np.arange(start, end + 1), anchors,
+                                                                    observed[anchors])
+
     def _interpolate_missing_travel_times(self, input_df: pd.DataFrame) -> pd.DataFrame:
         logging.info('Interpolate missing travel times')
         columns = input_df.columns
@@ -148,7 +411,12 @@ class TravelTime:
     def _compute_pair_distance_feet(self, value: str) -> float:
         start = value.split('-')[0]
         end = value.split('-')[1]
-        return abs((self._toll_locations_in_feet[end] - self._toll_locations_in_feet[start]))
+        return self._topology.get_distance(start, end)
+
+    def _compute_pair_free_flow_seconds(self, value: str) -> float:
+        start = value.split('-')[0]
+        end = value.split('-')[1]
+        return self._topology.get_free_flow_time(start, end)
 
     def _add_boundary_and_interpolate(self, input_series: pd.Series) -> pd.Series:
         """
@@ -162,7 +430,7 @@ class TravelTime:
         logging.debug('Pair distance (mi): ' + str(pair_distance))
 
         # Update first and last elements with free flow condition
-        free_flow_travel_time = datetime.timedelta(seconds=pair_distance * self.FREE_FLOW_SPEED)
+        free_flow_travel_time = datetime.timedelta(seconds=self._compute_pair_free_flow_seconds(pair))
         logging.debug('Free flow time (s): ' + str(free_flow_travel_time))
         input_series.iloc[0] = free_flow_travel_time
         last_element = input_series.shape[0] - 1
@@ -3,6 +3,7 @@ import logging
 import TollData as td
 import datetime
 import numpy as np
+import CorridorTopology as ct
 
 
 class TripBuilder:
@@ -20,11 +21,21 @@ class TripBuilder:
                     'trip_id_field': 'TRIP_ID', 'plate_id_field': 'PLATE'}
     _TRIP_TIMEOUT_MIN = datetime.timedelta(minutes=30)
     _current_trip_id = 0
+    _registry = None
+    _plate_keys = None
+    _tag_keys = None
+    _plate_index = None
+    _tag_index = None
+    _plate_variant_index = None
+    _topology = None
+    _max_speed_mph = None
+    _trip_ids = None
+    _plaza_directions = {}
 
     def __init__(self, data: pd.DataFrame, transaction_id=None, datetime_id=None,
                  plaza=None, transponder_id=None, trip_id=None, plate_id=None,
                  enable_logging=False, log_level=logging.INFO, trip_timeout=None,
-                 exit_nodes=None):
+                 exit_nodes=None, registry=None, topology=None, max_speed_mph=None):
 
         self._initialize_logging(enable_logging, log_level)
         logging.info('Create TripBuilder')
@@ -37,6 +48,11 @@ class TripBuilder:
         self._validate_fields()
         self._set_trip_timeout(trip_timeout)
         self._set_exit_nodes(exit_nodes)
+        self._registry = registry
+        self._topology = topology
+        self._max_speed_mph = max_speed_mph
+        self._plaza_directions = {}
+        self._build_key_indices()
 
     def get_dataframe(self):
         """
@@ -46,6 +62,66 @@ class TripBuilder:
         """
         return self._df
 
+    def _build_key_indices(self):
+        """
+        Encode plates and tags as int32 keys, using the registry if one is set, and
+        index the row positions of each key. Related trip searches then look up
+        rows by key instead of comparing plate and tag columns.
+        """
+        logging.info('Build plate and tag key indices')
+        plates = self._df[self._field_names['plate_id_field']]
+        tags = self._df[self._field_names['transponder_id_field']]
+        if self._registry is not None:
+            self._plate_keys = self._registry.encode_plates(plates)
+            self._tag_keys = self._registry.encode_tags(tags)
+        else:
+            plate_codes, plate_uniques = pd.factorize(plates.astype(object))
+            tag_codes, tag_uniques = pd.factorize(tags.astype(object))
+            self._plate_keys = plate_codes.astype(np.int32)
+            self._tag_keys = tag_codes.astype(np.int32)
+        self._plate_index = self._create_key_index(self._plate_keys)
+        self._tag_index = self._create_key_index(self._tag_keys)
+        self._plate_variant_index = None
+
+    @staticmethod
+    def _create_key_index(keys: np.ndarray) -> tuple:
+        """
+        :param keys: int32 array of keys, -1 for missing values
+        :return: tuple of sorted keys and the row positions in key order
+        """
+        order = np.argsort(keys, kind='stable')
+        return keys[order], order
+
+    @staticmethod
+    def _lookup_key_rows(index: tuple, key: int) -> np.ndarray:
+        """
+        :param index: tuple of sorted keys and row positions
+        :param key: int key
+        :return: array of row positions with the key, in row order
+        """
+        sorted_keys, order = index
+        first = np.searchsorted(sorted_keys, key, side='left')
+        last = np.searchsorted(sorted_keys, key, side='right')
+        return order[first:last]
+
+    def _build_plate_variant_index(self):
+        """
+        Match each plate in the data to the OCR compatible plates in the data once,
+        using an OCRPlateIndex, and merge them with the plate keys. The index maps
+        each plate key to the keys of the plates in the data that are OCR
+        combinations of it.
+        """
+        logging.info('Build plate variant index')
+        plates = pd.DataFrame({'VARIANT': self._df[self._field_names['plate_id_field']].astype(object),
+                               'VARIANT_KEY': self._plate_keys})
+        plates = plates[plates['VARIANT_KEY'] >= 0].drop_duplicates('VARIANT_KEY')
+        expanded = td.OCRPlateIndex(plates['VARIANT']).match_series(plates['VARIANT'])
+        expanded['PLATE_KEY'] = plates['VARIANT_KEY'].to_numpy()[expanded['ROW'].to_numpy()]
+        expanded = expanded.merge(plates, on='VARIANT')
+        order = np.argsort(expanded['PLATE_KEY'].to_numpy(), kind='stable')
+        self._plate_variant_index = (expanded['PLATE_KEY'].to_numpy()[order],
+                                     expanded['VARIANT_KEY'].to_numpy()[order])
+
     def _get_related_trips(self, transaction_id: int):
         """
         Get related trips based on transaction ID. This method is used to expand the search for related
@@ -53,45 +129,65 @@ class TripBuilder:
         :param transaction_id: int. Transaction ID of interest.
         :return: Dataframe. Related transactions.
         """
+        transaction_ids = self._df[self._field_names['transaction_id_field']].values
+        return self._df.iloc[self._get_related_positions(np.flatnonzero(transaction_ids == transaction_id))]
+
+    def _get_related_positions(self, start_positions: np.ndarray, in_group: np.ndarray = None) -> list:
+        """
+        Search for related transactions by plate, including OCR combinations, and tag keys.
+        :param start_positions: array of row positions to start the search from
+        :param in_group: bool array of rows already found, updated in place. Rows
+        already set are not added. Default None, a new array
+        :return: list of related row positions, in order found
+        """
         logging.info('Start related trip search')
+        if self._plate_variant_index is None:
+            self._build_plate_variant_index()
         plates = set({})
+        plate_variants = set({})
         tags = set({})
+        if in_group is None:
+            in_group = np.zeros(self._df.shape[0], dtype=bool)
+        in_group[start_positions] = True
+        group = list(start_positions)
         position = 0
-        elements = 1
-        df = self._df[self._df['TRANSACTION_ID'] == transaction_id]
 
-        while position < elements:
+        while position < len(group):
+            row = group[position]
             logging.debug('Position: ' + str(position))
-            plate_position = df['PLATE'].iloc[position]
-            tag_position = df['TRANSPONDER_ID'].iloc[position]
-            logging.debug('Use Plate: ' + str(plate_position))
-            logging.debug('Use Tag: ' + str(tag_position))
-
-            plate_combinations = td.PlateCombinatorics(plate_position).get_plate_combinations()
-            for plate in plate_combinations:
-                if plate not in plates:
-                    logging.debug('Adding plate: ' + str(plate))
-                    plates.add(plate)
-                    df_add = self._df[self._df['PLATE'] == plate]
-                    if df_add.shape[0] > 0:
-                        logging.debug('Add additional records: ' + str(df_add.shape[0]))
-                        df = pd.concat([df, df_add])
-                        df = df.drop_duplicates(subset='TRANSACTION_ID')
-                    elements = df.shape[0]
-
-            if tag_position not in tags and tag_position != np.nan:
-                logging.debug('Add tag: ' + str(tag_position))
-                tags.add(tag_position)
-                df_add = self._df[self._df['TRANSPONDER_ID'] == tag_position]
-                if df_add.shape[0] > 0:
-                    logging.debug('Add additional records: ' + str(df_add.shape[0]))
-                    df = pd.concat([df, df_add])
-                    df = df.drop_duplicates(subset='TRANSACTION_ID')
-                elements = df.shape[0]
+            plate_key = self._plate_keys[row]
+            tag_key = self._tag_keys[row]
+            logging.debug('Use Plate key: ' + str(plate_key))
+            logging.debug('Use Tag key: ' + str(tag_key))
+
+            if plate_key >= 0 and plate_key not in plates:
+                plates.add(plate_key)
+                for variant_key in self._lookup_key_rows(self._plate_variant_index, plate_key).tolist():
+                    if variant_key not in plate_variants:
+                        logging.debug('Adding plate key: ' + str(variant_key))
+                        plate_variants.add(variant_key)
+                        self._add_rows(self._lookup_key_rows(self._plate_index, variant_key),
+                                       in_group, group)
+
+            if tag_key >= 0 and tag_key not in tags:
+                logging.debug('Add tag key: ' + str(tag_key))
+                tags.add(tag_key)
+                self._add_rows(self._lookup_key_rows(self._tag_index, tag_key), in_group, group)
 
             position += 1
         logging.info('Related trip search complete')
-        return df
+        return group
+
+    @staticmethod
+    def _add_rows(rows: np.ndarray, in_group: np.ndarray, group: list):
+        """
+        Add rows not already in the group
+        """
+        new_rows = rows[~in_group[rows]]
+        if new_rows.shape[0] > 0:
+            logging.debug('Add additional records: ' + str(new_rows.shape[0]))
+            in_group[new_rows] = True
+            group.extend(new_rows.tolist())
 
     def _set_exit_nodes(self, node_list: list):
         """
@@ -109,27 +205,35 @@ class TripBuilder:
         :return: DataFrame. Output with new 'DIR_CHANGE' Series.
         """
         logging.info('Calculate directional changes')
-        cardinal_directions = ['NB', 'SB', 'WB', 'EB']
-        direction_list = []
-        output = [False]
-        plaza_list = df[self._field_names['plaza_id_field']].tolist()
-
-        # Convert to cardinal direction
-        for plaza in plaza_list:
-            for direction in cardinal_directions:
-                if direction in plaza:
-                    logging.debug('Use ' + str(direction) + ' for plaza ' + str(plaza))
-                    direction_list.append(direction)
-                    break
-
-        # Calculate changes in direction
-        for i in range(1, len(direction_list)):
-            output.append(direction_list[i] != direction_list[i - 1])
-
-        df['DIR_CHANGE'] = pd.Series(output, dtype='bool')
+        df['DIR_CHANGE'] = self._get_directional_changes(df[self._field_names['plaza_id_field']].to_numpy())
         logging.info('Directional change calculation complete')
         return df
 
+    def _get_directional_changes(self, plazas: np.ndarray) -> np.ndarray:
+        """
+        :param plazas: array of plazas, in time order
+        :return: bool array, whether the direction changed from the previous plaza
+        """
+        if self._topology is not None:
+            directions = self._topology.get_directions(self._topology.get_positions(plazas))
+        else:
+            directions = np.array([self._get_cardinal_direction(i) for i in plazas], dtype=object)
+        return np.append(False, directions[1:] != directions[:-1])
+
+    def _get_cardinal_direction(self, plaza) -> str:
+        """
+        :param plaza: plaza name
+        :return: str, first of NB, SB, WB, EB found in the plaza name, '' if none
+        """
+        if plaza not in self._plaza_directions:
+            self._plaza_directions[plaza] = ''
+            for direction in ['NB', 'SB', 'WB', 'EB']:
+                if direction in str(plaza):
+                    logging.debug('Use ' + str(direction) + ' for plaza ' + str(plaza))
+                    self._plaza_directions[plaza] = direction
+                    break
+        return self._plaza_directions[plaza]
+
     def _calculate_time_deltas(self, df: pd.DataFrame):
         """
         Calculate time deltas between transactions. Adds new 'TIME_DELTA_ Series.
@@ -137,63 +241,99 @@ class TripBuilder:
         :return: DataFrame with 'TIME_DELTA' Series.
         """
         logging.info('Start time delta calculation')
-        time_deltas = [datetime.timedelta(seconds=0)]
-        time_list = df[self._field_names['datetime_id_field']].tolist()
-
-        for i in range(1, len(time_list)):
-            time_diff = time_list[i] - time_list[i - 1]
-            logging.debug('Time difference' + str(time_diff))
-            time_deltas.append(time_diff)
-        df['TIME_DELTA'] = pd.Series(time_deltas)
+        times = pd.to_datetime(df[self._field_names['datetime_id_field']]).to_numpy()
+        df['TIME_DELTA'] = self._get_time_deltas(times)
         logging.info('End time delta calculation')
         return df
 
-    def build_trips(self):
+    @staticmethod
+    def _get_time_deltas(times: np.ndarray) -> np.ndarray:
+        """
+        :param times: datetime64 array, in time order
+        :return: timedelta64 array, time since the previous transaction
+        """
+        return np.append(np.timedelta64(0, 'ns'), np.diff(times)).astype('timedelta64[ns]')
+
+    def build_trips(self, summary: bool = False):
         """
         Build trips based on input DataFrame. Result saved to object and can be
-        access with the get_dataframe method.
+        access with the get_dataframe method, with the input rows in input order and
+        the build fields DIR_CHANGE, TIME_DELTA, BREAK_TRIP, and TRIP_ID_BUILD. The
+        build fields are preallocated and each group of related transactions is
+        written into them in place. The trip of each input row is also available
+        with get_trip_ids, and one row per trip with get_trip_summary.
+        :param summary: bool. Default False. Only record the trip of each row,
+        without adding the build fields. get_dataframe then returns the input DataFrame.
         """
         logging.info('Start trip building')
-        df_build = self._df
-        df_out = None
-
-        while df_build.shape[0] > 0:
-            logging.debug('Size of build dataframe: ' + str(df_build.shape[0]))
+        n = self._df.shape[0]
+        transaction_keys = pd.factorize(self._df[self._field_names['transaction_id_field']])[0]
+        transaction_index = self._create_key_index(transaction_keys)
+        times = pd.to_datetime(self._df[self._field_names['datetime_id_field']]).to_numpy()
+        plazas = self._df[self._field_names['plaza_id_field']].to_numpy()
+        built = np.zeros(n, dtype=bool)
+        dir_changes = np.zeros(n, dtype=bool)
+        time_deltas = np.zeros(n, dtype='timedelta64[ns]')
+        trip_breaks = np.zeros(n, dtype=bool)
+        self._trip_ids = np.full(n, -1, dtype=np.int32)
+        next_row = 0
+
+        while next_row < n:
+            if built[next_row]:
+                next_row += 1
+                continue
+            logging.debug('Rows remaining: ' + str(n - next_row))
             self._current_trip_id += 1
-            # Get related transaction
-            df_related_transactions = self._get_related_trips(df_build['TRANSACTION_ID'].iloc[0])
-            df_related_transactions = df_related_transactions.reset_index()
+            # Get related transaction, rows already built belong to an earlier trip
+            start_positions = self._lookup_key_rows(transaction_index, transaction_keys[next_row])
+            positions = np.array(self._get_related_positions(start_positions[~built[start_positions]],
+                                                             built))
 
             # Sort by datetime
-            datetime_name = self._field_names['datetime_id_field']
-            df_related_transactions[datetime_name] = pd.to_datetime(df_related_transactions[datetime_name])
-            df_related_transactions = df_related_transactions.sort_values(by=datetime_name)
-
-            # Determine directional changes
-            df_related_transactions = self._calculate_directional_changes(df_related_transactions)
-
-            # Calculate time deltas
-            df_related_transactions = self._calculate_time_deltas(df_related_transactions)
+            positions = positions[np.argsort(times[positions], kind='stable')]
 
-            # Determine trip break points
-            df_related_transactions = self._calculate_trip_breaks(df_related_transactions)
+            # Determine directional changes, time deltas, break points and trip IDs
+            group_dir_changes = self._get_directional_changes(plazas[positions])
+            group_time_deltas = self._get_time_deltas(times[positions])
+            group_breaks = self._get_trip_breaks(plazas[positions], group_dir_changes, group_time_deltas)
+            dir_changes[positions] = group_dir_changes
+            time_deltas[positions] = group_time_deltas
+            trip_breaks[positions] = group_breaks
+            self._trip_ids[positions] = self._get_trip_ids(group_breaks)
 
-            # Assign trip ID
-            df_related_transactions = self._assign_trip_id(df_related_transactions)
-
-            # Concat output results
-            if df_out is None:
-                df_out = df_related_transactions
-            else:
-                logging.debug('Concatenating results')
-                df_out = pd.concat([df_out, df_related_transactions])
+        logging.info('Complete building complete')
+        if not summary:
+            self._df = self._df.assign(DIR_CHANGE=dir_changes, TIME_DELTA=time_deltas,
+                                       BREAK_TRIP=trip_breaks, TRIP_ID_BUILD=self._trip_ids)
 
-            # Remove transactions from build dataframe
-            df_build = self._remove_built_transactions(df_build, df_related_transactions)
-            df_build = df_build.reset_index(drop=True)
+    def get_trip_ids(self) -> np.ndarray:
+        """
+        :return: int32 array of the built trip ID of each input row, in input row order
+        """
+        if self._trip_ids is None:
+            raise ValueError('Trips have not been built')
+        return self._trip_ids
 
-        logging.info('Complete building complete')
-        self._df = df_out
+    def get_trip_summary(self) -> pd.DataFrame:
+        """
+        Summarize the built trips with a single groupby, one row per trip
+        :return: DataFrame indexed by TRIP_ID_BUILD with ENTRY_PLAZA, EXIT_PLAZA,
+        START_TIME, END_TIME, TRANSACTIONS, SEGMENTS, PLATE, and TRANSPONDER_ID
+        """
+        datetime_name = self._field_names['datetime_id_field']
+        plaza_name = self._field_names['plaza_id_field']
+        df = pd.DataFrame({'TRIP_ID_BUILD': self.get_trip_ids(),
+                           'DATETIME': pd.to_datetime(self._df[datetime_name]).to_numpy(),
+                           'PLAZA': self._df[plaza_name].to_numpy(),
+                           'PLATE': self._df[self._field_names['plate_id_field']].to_numpy(),
+                           'TRANSPONDER_ID': self._df[self._field_names['transponder_id_field']].to_numpy()})
+        df = df.sort_values(['TRIP_ID_BUILD', 'DATETIME'], kind='stable')
+        summary = df.groupby('TRIP_ID_BUILD').agg(ENTRY_PLAZA=('PLAZA', 'first'), EXIT_PLAZA=('PLAZA', 'last'),
+                                                  START_TIME=('DATETIME', 'first'), END_TIME=('DATETIME', 'last'),
+                                                  TRANSACTIONS=('DATETIME', 'size'), PLATE=('PLATE', 'first'),
+                                                  TRANSPONDER_ID=('TRANSPONDER_ID', 'first'))
+        summary.insert(5, 'SEGMENTS', summary['TRANSACTIONS'] - 1)
+        return summary
 
     def _remove_built_transactions(self, df_full: pd.DataFrame, df_built: pd.DataFrame):
         """
@@ -215,33 +355,42 @@ class TripBuilder:
         :return: Dataframe with 'BREAK_TRIP' Series added
         """
         logging.info('Start trip break calculation')
-        trip_breaks = []
-        n = df.shape[0]
-
-        for i in range(n):
-            if n == 1:
-                continue
-
-            time_delta = df['TIME_DELTA'].iloc[i]
-            directional_change = df['DIR_CHANGE'].iloc[i]
-            prev_node = df[self._field_names['plaza_id_field']].iloc[i-1]
-            if i == 0:
-                trip_breaks.append(False)
-            elif i == n - 1:
-                trip_breaks.append(False)
-            elif directional_change or prev_node in self._exit_nodes or \
-                    time_delta > self._TRIP_TIMEOUT_MIN:
-                logging.debug('Break. Directional change: ' + str(directional_change))
-                logging.debug('Break. Previous node: ' + str(prev_node))
-                logging.debug('Break. Time Delta (min) : ' + str(time_delta))
-                trip_breaks.append(True)
-            else:
-                trip_breaks.append(False)
-
-        df['BREAK_TRIP'] = pd.Series(trip_breaks, dtype='bool')
+        df['BREAK_TRIP'] = self._get_trip_breaks(df[self._field_names['plaza_id_field']].to_numpy(),
+                                                 df['DIR_CHANGE'].to_numpy(dtype=bool),
+                                                 df['TIME_DELTA'].to_numpy(dtype='timedelta64[ns]'))
         logging.info('End trip break calculation')
         return df
 
+    def _get_trip_breaks(self, plazas: np.ndarray, dir_changes: np.ndarray,
+                         time_deltas: np.ndarray) -> np.ndarray:
+        """
+        A trip breaks at a transaction after a directional change, an exit plaza,
+        an infeasible plaza pair, the trip timeout, or, if max_speed_mph is set, a
+        plaza pair travelled faster than it. The first and last transactions never
+        break.
+        :param plazas: array of plazas, in time order
+        :param dir_changes: bool array of directional changes
+        :param time_deltas: timedelta64 array of time since the previous transaction
+        :return: bool array
+        """
+        n = plazas.shape[0]
+        breaks = np.zeros(n, dtype=bool)
+        if n < 3:
+            return breaks
+        stop = np.isin(plazas[:-1], self._exit_nodes)
+        if self._topology is not None:
+            positions = self._topology.get_positions(plazas)
+            stop |= self._topology.is_exit(positions[:-1])
+            stop |= ~self._topology.is_feasible(positions[:-1], positions[1:])
+            if self._max_speed_mph is not None:
+                stop |= self._topology.is_impossible_speed(positions[:-1], positions[1:],
+                                                           time_deltas[1:] / np.timedelta64(1, 's'),
+                                                           self._max_speed_mph)
+        breaks[1:] = dir_changes[1:] | stop | (time_deltas[1:] > np.timedelta64(self._TRIP_TIMEOUT_MIN))
+        breaks[-1] = False
+        logging.debug('Breaks: ' + str(np.flatnonzero(breaks).tolist()))
+        return breaks
+
     def _assign_trip_id(self, df: pd.DataFrame):
         """
         Add 'TRIP_ID_BUILD' field to input DataFrame, where 'TRIP_ID_BUILD'
@@ -250,26 +399,21 @@ class TripBuilder:
         :return: DataFrame with 'TRIP_ID_BUILD' field
         """
         logging.info('Start assign trip ID')
-        output = []
-        break_list = df['BREAK_TRIP'].tolist()
-        n = len(break_list)
-
-        for i in range(n):
-            if i == 0 or n == 1:
-                output.append(self._current_trip_id)
-                continue
-            elif i == n - 1:
-                output.append(self._current_trip_id)
-            elif break_list[i]:
-                self._current_trip_id += 1
-                logging.debug('Increment trip ID: ' + str(self._current_trip_id))
-                output.append(self._current_trip_id)
-            else:
-                output.append(self._current_trip_id)
-        df['TRIP_ID_BUILD'] = pd.Series(output)
+        df['TRIP_ID_BUILD'] = self._get_trip_ids(df['BREAK_TRIP'].to_numpy(dtype=bool))
         logging.info('End assign trip ID')
         return df
 
+    def _get_trip_ids(self, breaks: np.ndarray) -> np.ndarray:
+        """
+        Number trips from the current trip ID, incrementing at each break
+        :param breaks: bool array of trip breaks
+        :return: int32 array of trip IDs
+        """
+        trip_ids = self._current_trip_id + np.cumsum(breaks, dtype=np.int32)
+        if trip_ids.shape[0] > 0:
+            self._current_trip_id = int(trip_ids[-1])
+        return trip_ids
+
     @staticmethod
     def _initialize_logging(value: bool, log_level: int):
         if value: